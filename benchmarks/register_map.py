@@ -0,0 +1,97 @@
+"""
+Micro-benchmark of the status decoder
+Compares the register map decoder (one struct.unpack_from driven by HYSEN_HEAT_REGISTERS)
+with the former hand-written index lookups of get_device_status.
+Run from the repository root: python benchmarks/register_map.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'custom_components'))
+
+from hysenheating.hysenheating_device import (
+    HYSEN_HEAT_FIELD_NAMES,
+    hysen_heat_decode_registers
+)
+
+class LegacyStatus(object):
+    pass
+
+# get_device_status parser before the register map, on a response with its 3 bytes header
+def legacy_decode(_response):
+    self = LegacyStatus()
+    self.remote_lock = _response[3] & 0x01
+    self.manual_over_auto = (_response[4] >> 6) & 0x01
+    self.valve_state =  (_response[4] >> 4) & 0x01
+    self.power_state =  _response[4] & 0x01
+    self.room_temp = float((_response[5] & 0xFF) / 2.0)
+    self.target_temp = float((_response[6] & 0xFF) / 2.0)
+    self.operation_mode = _response[7] & 0x0F
+    self.schedule = (_response[7] >> 4) & 0x0F
+    self.sensor = _response[8]
+    self.external_limit_temp = float(_response[9])
+    self.hysteresis = _response[10]
+    self.max_temp = _response[11]
+    self.min_temp = _response[12]
+    self.calibration = (_response[13] << 8) + _response[14]
+    if self.calibration > 0x7FFF:
+        self.calibration = self.calibration - 0x10000
+    self.calibration = float(self.calibration / 2.0)
+    self.frost_protection = _response[15]
+    self.poweron = _response[16]
+    self.unknown1 = _response[17]
+    self.external_temp = float((_response[18] & 0xFF) / 2.0)
+    self.clock_hour = _response[19]
+    self.clock_min = _response[20]
+    self.clock_sec = _response[21]
+    self.clock_weekday = _response[22]
+    self.period1_hour = _response[23]
+    self.period1_min = _response[24]
+    self.period2_hour = _response[25]
+    self.period2_min = _response[26]
+    self.period3_hour = _response[27]
+    self.period3_min = _response[28]
+    self.period4_hour = _response[29]
+    self.period4_min = _response[30]
+    self.period5_hour = _response[31]
+    self.period5_min = _response[32]
+    self.period6_hour = _response[33]
+    self.period6_min = _response[34]
+    self.we_period1_hour = _response[35]
+    self.we_period1_min = _response[36]
+    self.we_period6_hour = _response[37]
+    self.we_period6_min = _response[38]
+    self.period1_temp = float(_response[39] / 2.0)
+    self.period2_temp = float(_response[40] / 2.0)
+    self.period3_temp = float(_response[41] / 2.0)
+    self.period4_temp = float(_response[42] / 2.0)
+    self.period5_temp = float(_response[43] / 2.0)
+    self.period6_temp = float(_response[44] / 2.0)
+    self.we_period1_temp = float(_response[45] / 2.0)
+    self.we_period6_temp = float(_response[46] / 2.0)
+    self.unknown2 = _response[47]
+    self.unknown3 = _response[48]
+    return self
+
+RESPONSE = bytearray([0x01, 0x03, 0x2E,
+    0x00, 0x11, 0x2C, 0x2E, 0x31, 0x00, 0x2A, 0x02, 0x23, 0x05, 0xFF, 0xFD, 0x00, 0x01,
+    0x00, 0x2B, 0x08, 0x14, 0x0A, 0x02, 0x06, 0x00, 0x08, 0x00, 0x0B, 0x1E, 0x0C, 0x1E,
+    0x11, 0x1E, 0x16, 0x00, 0x08, 0x00, 0x17, 0x00, 0x2A, 0x20, 0x20, 0x20, 0x2A, 0x20,
+    0x2A, 0x20, 0x01, 0x02])
+
+def main():
+    legacy = legacy_decode(RESPONSE)
+    for name, value in zip(HYSEN_HEAT_FIELD_NAMES, hysen_heat_decode_registers(RESPONSE[3:])):
+        assert getattr(legacy, name) == value, name
+    number = 100000
+    registers = RESPONSE[3:]
+    for name, statement in [
+        ('legacy index lookups', lambda: legacy_decode(RESPONSE)),
+        ('register map struct', lambda: hysen_heat_decode_registers(registers))]:
+        seconds = min(timeit.repeat(statement, number = number, repeat = 5))
+        print('%-22s %6.2f us per status' % (name, seconds / number * 1e6))
+
+if __name__ == '__main__':
+    main()
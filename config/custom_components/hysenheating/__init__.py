@@ -3,3 +3,11 @@ Support for Hysen Thermostat Controller for floor heating.
 Hysen HY03-1-Wifi device and derivative
 http://www.xmhysen.com/products_detail/productId=197.html
 """
+
+# Home Assistant configuration, the sensor platforms of the thermostats are loaded with it
+DATA_HASS_CONFIG = 'hysenheating_hass_config'
+
+async def async_setup(hass, config):
+    """Keep the Home Assistant configuration for the climate platform."""
+    hass.data[DATA_HASS_CONFIG] = config
+    return True
@@ -0,0 +1,58 @@
+"""
+Support for Hysen Thermostat Controller binary sensors.
+Hysen HY03-1-Wifi device
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import logging
+
+from homeassistant.components.binary_sensor import BinarySensorDevice
+from homeassistant.const import (
+    CONF_NAME,
+    CONF_HOST
+)
+
+from .climate import (
+    DATA_KEY,
+    ATTR_VALVE_STATE
+)
+from .hysenheating_device import HYSEN_HEAT_VALVE_ON
+from .hysenheating_entity import HysenHeatingEntity
+
+_LOGGER = logging.getLogger(__name__)
+
+DEVICE_CLASS_HEAT = 'heat'
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info = None):
+    """Set up the binary sensors of a Hysen heating thermostat."""
+    if discovery_info is None:
+        return
+
+    name = discovery_info[CONF_NAME]
+    heating = hass.data[DATA_KEY][discovery_info[CONF_HOST]]
+
+    async_add_entities([HysenHeatingValveSensor(name, heating)])
+
+def _valve_open(status):
+    """Return True if the valve is open."""
+    return status.valve_state == HYSEN_HEAT_VALVE_ON
+
+class HysenHeatingValveSensor(HysenHeatingEntity, BinarySensorDevice):
+    """Valve of a Hysen Heating thermostat, on while the floor is heated."""
+
+    def __init__(self, name, heating):
+        """Initialize the valve sensor."""
+        super().__init__(
+            '{} {}'.format(name, ATTR_VALVE_STATE.replace('_', ' ')), 
+            heating, 
+            _valve_open)
+
+    @property
+    def is_on(self):
+        """Return True if the valve is open."""
+        return self._value
+
+    @property
+    def device_class(self):
+        """Return the device class of the sensor."""
+        return DEVICE_CLASS_HEAT
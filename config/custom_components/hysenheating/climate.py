@@ -5,10 +5,12 @@ http://www.xmhysen.com/products_detail/productId=197.html
 """
 
 import asyncio
+from datetime import timedelta
 from functools import partial
 import binascii
 import socket
 import logging
+import time
 
 import voluptuous as vol
 
@@ -42,13 +44,27 @@ from homeassistant.const import (
     ATTR_TEMPERATURE,
     PRECISION_WHOLE,
     PRECISION_HALVES, 
-    ATTR_ENTITY_ID
+    ATTR_ENTITY_ID,
+    CONF_SCAN_INTERVAL,
+    EVENT_HOMEASSISTANT_STOP
 )
+from homeassistant.core import callback
+from homeassistant.helpers.discovery import async_load_platform
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
 import homeassistant.helpers.config_validation as cv
 import homeassistant.util.dt as dt_util
 
+from . import DATA_HASS_CONFIG
 from .hysenheating_device import (
     HysenHeatingDevice,
+    hysen_heat_async_discover,
+    HYSEN_HEAT_DEVTYPE,
+    HYSEN_HEAT_PRIORITY_INTERACTIVE,
+    HYSEN_HEAT_PRIORITY_VERIFY,
+    HYSEN_HEAT_PRIORITY_POLL,
+    HYSEN_HEAT_PRIORITY_MAINTENANCE,
     HYSEN_HEAT_REMOTE_LOCK_OFF,
     HYSEN_HEAT_REMOTE_LOCK_ON,
     HYSEN_HEAT_POWER_OFF,
@@ -76,6 +92,15 @@ from .hysenheating_device import (
     HYSEN_HEAT_MAX_TEMP,
     HYSEN_HEAT_MIN_TEMP
 )
+from .hysenheating_transport import HysenHeatingTransport
+from .hysenheating_clock import HysenHeatingClock
+from .hysenheating_entity import SIGNAL_HYSEN_HEATING_UPDATED
+from .hysenheating_coordinator import (
+    HysenHeatingCoordinator,
+    HysenHeatingCommandCoalescer,
+    HysenHeatingPollInterval,
+    HYSEN_COORDINATOR_DEFAULT_PARALLEL
+)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -202,18 +227,56 @@ HASS_MODE_TO_HYSEN = {
     STATE_AUTO   : HYSEN_HEAT_MODE_AUTO,
 }
 
-HYSEN_HEATING   = 0x4EAD
+HYSEN_HEATING   = HYSEN_HEAT_DEVTYPE
 DEFAULT_NAME    = 'Hysen Heating Thermostat'
 DEFAULT_TIMEOUT = 10
+DEFAULT_SCAN_INTERVAL = timedelta(seconds = 60)
+DEFAULT_HEARTBEAT = timedelta(minutes = 15)
+DEFAULT_MAX_SCAN_INTERVAL = timedelta(minutes = 15)
+DEFAULT_PARALLEL_COMMANDS = 8
 
-DATA_KEY = 'climate.hysen_heating'
+# seconds after a command before the device is read again, to catch a state diverging from the write
+RECONCILE_DELAY = 5
+
+# room temperature change rate, degrees per hour, from which the device counts as active
+ROOM_TEMP_ACTIVE_RATE = 1.0
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
+CONF_HEARTBEAT = 'heartbeat'
+CONF_DISCOVERY = 'discovery'
+CONF_PARALLEL_POLLS = 'parallel_polls'
+CONF_MAX_SCAN_INTERVAL = 'max_scan_interval'
+CONF_PARALLEL_COMMANDS = 'parallel_commands'
+
+DATA_KEY = 'climate.hysen_heating'
+DATA_TRANSPORT = 'climate.hysen_heating_transport'
+DATA_SESSIONS = 'climate.hysen_heating_sessions'
+DATA_COORDINATOR = 'climate.hysen_heating_coordinator'
+# thermostats a service call talks to at the same time, fleet wide
+DATA_COMMAND_SEMAPHORE = 'climate.hysen_heating_command_semaphore'
+# entity id to entity index of the thermostats, for the services
+DATA_ENTITY_IDS = 'climate.hysen_heating_entity_ids'
+
+# session keys of the thermostats, kept across restarts
+STORAGE_KEY = 'hysenheating.sessions'
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
+
+HYSEN_DOMAIN = 'hysenheating'
+HYSEN_PLATFORMS = ['sensor', 'binary_sensor']
+
+# a thermostat is configured with its host and mac, or the thermostats are discovered 
+# by broadcasting to each of the discovery addresses (e.g. 192.168.1.255)
+PLATFORM_SCHEMA = vol.All(PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_NAME, default = DEFAULT_NAME): cv.string,
-    vol.Required(CONF_HOST): cv.string,
-    vol.Required(CONF_MAC): cv.string,
+    vol.Inclusive(CONF_HOST, 'device'): cv.string,
+    vol.Inclusive(CONF_MAC, 'device'): cv.string,
+    vol.Optional(CONF_DISCOVERY): vol.All(cv.ensure_list, [cv.string]),
     vol.Optional(CONF_TIMEOUT, default = DEFAULT_TIMEOUT): cv.positive_int, 
-})
+    vol.Optional(CONF_HEARTBEAT, default = DEFAULT_HEARTBEAT): cv.time_period,
+    vol.Optional(CONF_PARALLEL_POLLS, default = HYSEN_COORDINATOR_DEFAULT_PARALLEL): cv.positive_int,
+    vol.Optional(CONF_MAX_SCAN_INTERVAL, default = DEFAULT_MAX_SCAN_INTERVAL): cv.time_period,
+    vol.Optional(CONF_PARALLEL_COMMANDS, default = DEFAULT_PARALLEL_COMMANDS): cv.positive_int,
+}), cv.has_at_least_one_key(CONF_HOST, CONF_DISCOVERY))
 
 ATTR_KEY_LOCK             = 'key_lock'
 ATTR_VALVE_STATE          = 'valve_state'
@@ -229,10 +292,6 @@ ATTR_HEATING_MAX_TEMP     = 'max_temp'
 ATTR_HEATING_MIN_TEMP     = 'min_temp'
 ATTR_FROST_PROTECTION     = 'frost_protection'
 ATTR_POWERON              = 'poweron'
-ATTR_CLOCK_HOUR           = 'clock_hour'
-ATTR_CLOCK_MIN            = 'clock_min'
-ATTR_CLOCK_SEC            = 'clock_sec'
-ATTR_CLOCK_WEEKDAY        = 'clock_weekday'
 ATTR_SCHEDULE             = 'schedule'
 ATTR_PERIOD_HOUR          = 'hour'
 ATTR_PERIOD_MIN           = 'min'
@@ -450,18 +509,101 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info
     """Set up the Hysen heating thermostat platform."""
     if DATA_KEY not in hass.data:
         hass.data[DATA_KEY] = {}
+        hass.data[DATA_ENTITY_IDS] = {}
+
+    if DATA_TRANSPORT not in hass.data:
+        transport = HysenHeatingTransport()
+        hass.data[DATA_TRANSPORT] = transport
+
+        async def async_close_transport(event):
+            """Close the UDP endpoint shared by all thermostats."""
+            transport.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close_transport)
+
+    # the fleet wide settings are taken from the first platform entry
+    if DATA_COORDINATOR not in hass.data:
+        coordinator = HysenHeatingCoordinator(config.get(CONF_PARALLEL_POLLS))
+        hass.data[DATA_COORDINATOR] = coordinator
+        hass.data[DATA_COMMAND_SEMAPHORE] = asyncio.Semaphore(config.get(CONF_PARALLEL_COMMANDS))
+        async_register_services(hass)
+
+        async def async_close_coordinator(event):
+            """Stop polling the thermostats."""
+            coordinator.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close_coordinator)
+
+    if DATA_SESSIONS not in hass.data:
+        hass.data[DATA_SESSIONS] = HysenHeatingSessions(hass)
+    sessions = hass.data[DATA_SESSIONS]
+    await sessions.async_load()
 
-    host = config.get(CONF_HOST)
     name = config.get(CONF_NAME)
-    mac_addr = binascii.unhexlify(config.get(CONF_MAC).encode().replace(b':', b''))
     timeout = config.get(CONF_TIMEOUT)
-    
-    hysen_device = HysenHeatingDevice((host, 80), mac_addr, HYSEN_HEATING, timeout)
-    
-    device = HysenHeating(name, hysen_device, host)
-    hass.data[DATA_KEY][host] = device
-
-    async_add_entities([device], update_before_add = True)
+    scan_interval = config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+    heartbeat = config.get(CONF_HEARTBEAT)
+    max_scan_interval = config.get(CONF_MAX_SCAN_INTERVAL)
+
+    hysen_devices = []
+    if CONF_HOST in config:
+        host = config.get(CONF_HOST)
+        mac_addr = binascii.unhexlify(config.get(CONF_MAC).encode().replace(b':', b''))
+        hysen_device = HysenHeatingDevice(
+            (host, 80), 
+            mac_addr, 
+            HYSEN_HEATING, 
+            timeout, 
+            hass.data[DATA_TRANSPORT])
+        sessions.restore(hysen_device)
+        hysen_devices.append((name, hysen_device))
+
+    if CONF_DISCOVERY in config:
+        discovered = await hysen_heat_async_discover(
+            hass.data[DATA_TRANSPORT], 
+            config.get(CONF_DISCOVERY), 
+            timeout, 
+            restore = sessions.restore)
+        _LOGGER.debug("Discovered %s thermostats.", len(discovered))
+        for hysen_device in discovered:
+            sessions.save(hysen_device)
+            hysen_devices.append(('{} {}'.format(name, hysen_device.host[0]), hysen_device))
+
+    devices = []
+    for device_name, hysen_device in hysen_devices:
+        host = hysen_device.host[0]
+        if host in hass.data[DATA_KEY]:
+            continue
+        device = HysenHeating(
+            device_name, 
+            hysen_device, 
+            host, 
+            scan_interval, 
+            max_scan_interval, 
+            heartbeat)
+        hass.data[DATA_KEY][host] = device
+        devices.append(device)
+
+    # the first reads are made by the coordinator, at most parallel_polls at a time
+    async_add_entities(devices)
+
+    for device in devices:
+        for platform in HYSEN_PLATFORMS:
+            hass.async_create_task(async_load_platform(
+                hass, 
+                platform, 
+                HYSEN_DOMAIN, 
+                {CONF_HOST: device.host, CONF_NAME: device.name}, 
+                hass.data.get(DATA_HASS_CONFIG, {})))
+
+@callback
+def async_register_services(hass):
+    """Register the thermostat services, once for all the platform entries."""
+
+    async def async_service_command(heating, method, params):
+        """Call a service method on one thermostat, at most parallel_commands at a time."""
+        async with hass.data[DATA_COMMAND_SEMAPHORE]:
+            await getattr(heating, method['method'])(**params)
 
     async def async_service_handler(service):
         """Map services to methods on target thermostat."""
@@ -470,20 +612,23 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info
                   if key != ATTR_ENTITY_ID}
         entity_ids = service.data.get(ATTR_ENTITY_ID)
         if entity_ids:
-            target_heatings = [dev for dev in hass.data[DATA_KEY].values()
-                                  if dev.entity_id in entity_ids]
+            index = hass.data[DATA_ENTITY_IDS]
+            target_heatings = [index[entity_id] for entity_id in set(entity_ids) 
+                               if entity_id in index]
         else:
-            target_heatings = hass.data[DATA_KEY].values()
+            target_heatings = list(hass.data[DATA_KEY].values())
  
-        update_tasks = []
-        for heating in target_heatings:
-            await getattr(heating, method['method'])(**params)
-
-        for heating in target_heatings:
-            update_tasks.append(heating.async_update_ha_state(True))
+        if not target_heatings:
+            return
 
-        if update_tasks:
-            await asyncio.wait(update_tasks, loop = hass.loop)
+        # a failing thermostat doesn't hold back or abort the others
+        # the state is published from the confirmed writes, no refresh is needed
+        results = await asyncio.gather(
+            *[async_service_command(heating, method, params) for heating in target_heatings], 
+            return_exceptions = True)
+        for heating, result in zip(target_heatings, results):
+            if isinstance(result, Exception):
+                _LOGGER.error("[%s] Error in %s: %s", heating.host, service.service, result)
 
     for heating_service in SERVICE_TO_METHOD:
         schema = SERVICE_TO_METHOD[heating_service].get('schema', CLIMATE_SERVICE_SCHEMA)
@@ -493,22 +638,106 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info
             async_service_handler, 
             schema = schema)
 
+class HysenHeatingSessions(object):
+    """Session id and AES key negotiated with each thermostat, persisted by MAC.
+
+    A thermostat whose session is cached skips the broadlink handshake at
+    startup, it is only done again once the device rejects the cached key.
+    """
+
+    def __init__(self, hass):
+        """Initialize the session cache."""
+        self._hass = hass
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._sessions = {}
+        self._load_task = None
+
+    async def async_load(self):
+        """Load the cached sessions, once."""
+        if self._load_task is None:
+            self._load_task = self._hass.async_create_task(self._async_load())
+        await self._load_task
+
+    async def _async_load(self):
+        """Read the cached sessions from storage."""
+        self._sessions = await self._store.async_load() or {}
+
+    def restore(self, hysen_device):
+        """Restore the cached session of a device. Returns True if there was one."""
+        session = self._sessions.get(binascii.hexlify(hysen_device.mac).decode())
+        if session is None:
+            return False
+        hysen_device.restore_session(
+            binascii.unhexlify(session['id']), 
+            binascii.unhexlify(session['key']))
+        return True
+
+    @callback
+    def save(self, hysen_device):
+        """Cache the current session of a device."""
+        device_id, key = hysen_device.session
+        self._sessions[binascii.hexlify(hysen_device.mac).decode()] = {
+            'id': binascii.hexlify(device_id).decode(),
+            'key': binascii.hexlify(key).decode(),
+        }
+        self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    @callback
+    def discard(self, hysen_device):
+        """Forget the session of a device rejecting it."""
+        if self._sessions.pop(binascii.hexlify(hysen_device.mac).decode(), None) is not None:
+            self._store.async_delay_save(self._data_to_save, STORAGE_SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self):
+        """Return the sessions to write to storage."""
+        return self._sessions
+
 class HysenHeating(ClimateDevice):
     """Representation of a Hysen Heating device."""
 
-    def __init__(self, name, hysen_device, host):
+    def __init__(self, name, hysen_device, host, scan_interval, max_scan_interval, heartbeat):
         """Initialize the Hysen Heating device."""
         self._name = name
         self._host = host
         self._hysen_device = hysen_device
+        # polled every scan_interval while active, less and less often up to max_scan_interval while stable
+        self._poll_interval = HysenHeatingPollInterval(
+            scan_interval.total_seconds(), 
+            max_scan_interval.total_seconds())
+        self._poll_time = None
+        self._clock = HysenHeatingClock()
+        # slider drags and mode changes in quick succession are written once, their final state
+        self._commands = HysenHeatingCommandCoalescer(self._async_commit_commands)
+        self._heartbeat = heartbeat.total_seconds()
 
         self._device_available = False
-        self._device_authenticated = False
+        self._device_authenticated = hysen_device.authenticated
+
+        self._unsub_poll = None
+        self._unsub_reconcile = None
+        self._indexed_entity_id = None
+        self._polling = False
+        self._published_state = None
+        self._published_time = None
+
+        self._attributes_state = None
+        self._attributes = {}
+
+    @property
+    def host(self):
+        """Return the host of the device."""
+        return self._host
+
+    @property
+    def hysen_device(self):
+        """Return the device shared with the sensor entities of this thermostat."""
+        return self._hysen_device
 
     @property
     def should_poll(self):
-        """Return the polling state."""
-        return True
+        """Return the polling state. The fleet coordinator polls the device, see _async_poll."""
+        return False
 
     @property
     def name(self):
@@ -532,54 +761,22 @@ class HysenHeating(ClimateDevice):
 
     @property
     def device_state_attributes(self):
-        """Return the specific state attributes of the device."""
+        """Return the specific state attributes of the device, rebuilt only when the register snapshot changed."""
+        state = (self._device_available, self._hysen_device.status)
+        if state == self._attributes_state:
+            return self._attributes
         attr = {}
         if self._device_available:
             attr.update({
-                ATTR_VALVE_STATE: str(HYSEN_VALVE_STATE_TO_HASS[self._hysen_device.valve_state]),
                 ATTR_KEY_LOCK: str(HYSEN_KEY_LOCK_TO_HASS[self._hysen_device.remote_lock]),
                 ATTR_POWER_STATE: str(HYSEN_POWER_STATE_TO_HASS[self._hysen_device.power_state]),
                 ATTR_MANUAL_OVER_AUTO: str(HYSEN_MANUAL_OVER_AUTO_TO_HASS[self._hysen_device.manual_over_auto]),
                 ATTR_SENSOR: str(HYSEN_SENSOR_TO_HASS[self._hysen_device.sensor]),
-                ATTR_ROOM_TEMP: float(self._hysen_device.room_temp),
-                ATTR_EXTERNAL_TEMP: float(self._hysen_device.external_temp),
-                ATTR_EXTERNAL_TARGET_TEMP: float(self._hysen_device.external_limit_temp),
-                ATTR_HYSTERESIS: int(self._hysen_device.hysteresis),
-                ATTR_CALIBRATION: float(self._hysen_device.calibration),
-                ATTR_HEATING_MAX_TEMP: int(self._hysen_device.max_temp),
-                ATTR_HEATING_MIN_TEMP: int(self._hysen_device.min_temp),
                 ATTR_FROST_PROTECTION: str(HYSEN_FROST_PROTECTION_TO_HASS[self._hysen_device.frost_protection]),
                 ATTR_POWERON: str(HYSEN_POWERON_TO_HASS[self._hysen_device.poweron]),
-                ATTR_CLOCK_HOUR: int(self._hysen_device.clock_hour),
-                ATTR_CLOCK_MIN: int(self._hysen_device.clock_min),
-                ATTR_CLOCK_SEC: int(self._hysen_device.clock_sec),
-                ATTR_CLOCK_WEEKDAY: int(self._hysen_device.clock_weekday),
-                ATTR_SCHEDULE: str(HYSEN_SCHEDULE_TO_HASS[self._hysen_device.schedule]),
-                ATTR_PERIOD1_HOUR: int(self._hysen_device.period1_hour),
-                ATTR_PERIOD1_MIN: int(self._hysen_device.period1_min),
-                ATTR_PERIOD1_TEMP: float(self._hysen_device.period1_temp),
-                ATTR_PERIOD2_HOUR: int(self._hysen_device.period2_hour),
-                ATTR_PERIOD2_MIN: int(self._hysen_device.period2_min),
-                ATTR_PERIOD2_TEMP: float(self._hysen_device.period2_temp),
-                ATTR_PERIOD3_HOUR: int(self._hysen_device.period3_hour),
-                ATTR_PERIOD3_MIN: int(self._hysen_device.period3_min),
-                ATTR_PERIOD3_TEMP: float(self._hysen_device.period3_temp),
-                ATTR_PERIOD4_HOUR: int(self._hysen_device.period4_hour),
-                ATTR_PERIOD4_MIN: int(self._hysen_device.period4_min),
-                ATTR_PERIOD4_TEMP: float(self._hysen_device.period4_temp),
-                ATTR_PERIOD5_HOUR: int(self._hysen_device.period5_hour),
-                ATTR_PERIOD5_MIN: int(self._hysen_device.period5_min),
-                ATTR_PERIOD5_TEMP: float(self._hysen_device.period5_temp),
-                ATTR_PERIOD6_HOUR: int(self._hysen_device.period6_hour),
-                ATTR_PERIOD6_MIN: int(self._hysen_device.period6_min),
-                ATTR_PERIOD6_TEMP: float(self._hysen_device.period6_temp),
-                ATTR_WE_PERIOD1_HOUR: int(self._hysen_device.we_period1_hour),
-                ATTR_WE_PERIOD1_MIN: int(self._hysen_device.we_period1_min),
-                ATTR_WE_PERIOD1_TEMP: float(self._hysen_device.we_period1_temp),
-                ATTR_WE_PERIOD6_HOUR: int(self._hysen_device.we_period6_hour),
-                ATTR_WE_PERIOD6_MIN: int(self._hysen_device.we_period6_min),
-                ATTR_WE_PERIOD6_TEMP: float(self._hysen_device.we_period6_temp),
             })
+        self._attributes_state = state
+        self._attributes = attr
         return attr
 
     @property
@@ -638,10 +835,7 @@ class HysenHeating(ClimateDevice):
     async def async_set_temperature(self, **kwargs):
         """Set new target temperature."""
         target_temp = float(kwargs.get(ATTR_TEMPERATURE))
-        await self._try_command(
-            "Error in set_temperature", 
-            self._hysen_device.set_target_temp, 
-            target_temp)
+        await self._commands.async_submit(target_temp = target_temp)
 
     async def async_set_external_limit_temperature(self, external_limit_temp):
         """Set external limit temperature."""
@@ -657,19 +851,40 @@ class HysenHeating(ClimateDevice):
                 self._host,
                 operation_mode)
             return
-        if (operation_mode.lower() != self.current_operation):
+        await self._commands.async_submit(operation_mode = operation_mode.lower())
+
+    async def _async_commit_commands(self, state):
+        """Write the final state of the coalesced set_operation_mode and set_temperature calls, in the order they were last made. Raises the first error to the callers."""
+        # a mode and a target temperature are not merged in one write, a target temperature 
+        # written in auto switches the device to manual
+        error = None
+        for field, value in state.items():
+            if field == 'operation_mode':
+                calls = self._operation_mode_calls(value)
+            else:
+                calls = [(self._hysen_device.set_target_temp, value)]
+            if calls:
+                field_error = await self._try_transaction("Error in set_temperature/set_operation_mode", calls)
+                if error is None:
+                    error = field_error
+        if error is not None:
+            raise error
+
+    def _operation_mode_calls(self, operation_mode):
+        """Return the device setter calls switching to an operation mode."""
+        calls = []
+        if operation_mode != self.current_operation:
             if (self.current_operation == STATE_AUTO):
                 if (HASS_MANUAL_OVER_AUTO_TO_HYSEN[self._hysen_device.manual_over_auto] == True):
                     operation_mode = STATE_AUTO
                 else:
-                    await self._try_command(
-                        "Error in set_temperature", 
+                    calls.append((
                         self._hysen_device.set_target_temp, 
-                        self._hysen_device.manual_target_temp)
-            await self._try_command(
-                "Error in set_operation_mode", 
+                        self._hysen_device.manual_target_temp))
+            calls.append((
                 self._hysen_device.set_operation_mode, 
-                HASS_MODE_TO_HYSEN[operation_mode.lower()])
+                HASS_MODE_TO_HYSEN[operation_mode]))
+        return calls
 
     async def async_turn_on(self):
         """Turn device on."""
@@ -746,21 +961,19 @@ class HysenHeating(ClimateDevice):
             self._hysen_device.set_poweron, 
             HASS_POWERON_TO_HYSEN[poweron])
 
-    async def async_set_time_now(self):
+    async def async_set_time_now(self, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
         """Set device time to system time."""
-        clock_weekday = int(dt_util.as_local(dt_util.now()).strftime('%w'))
-        if clock_weekday == 0:
-            clock_weekday = 7
-        clock_hour = int(dt_util.as_local(dt_util.now()).strftime('%H'))
-        clock_min = int(dt_util.as_local(dt_util.now()).strftime('%M'))
-        clock_sec = int(dt_util.as_local(dt_util.now()).strftime('%S'))
-        await self._try_command(
+        now = dt_util.as_local(dt_util.now())
+        await self._try_transaction(
             "Error in set_time", 
-            self._hysen_device.set_time, 
-            clock_hour, 
-            clock_min, 
-            clock_sec, 
-            clock_weekday)
+            [(self._hysen_device.set_time, 
+              now.hour, 
+              now.minute, 
+              now.second, 
+              now.isoweekday())], 
+            priority)
+        if self._device_available:
+            self._clock.synced(time.monotonic())
 
     async def async_set_schedule(self, schedule):
         """Set week schedule 1 = 1234567 2 = 12345,6 3 = 12345,67."""
@@ -849,9 +1062,10 @@ class HysenHeating(ClimateDevice):
     async def async_authenticate_device(self):
         """Connect to device ."""
         try:
-            _authenticated = await self.hass.async_add_executor_job(self._hysen_device.auth)
+            _authenticated = await self._hysen_device.async_auth()
             if _authenticated:
                 _LOGGER.debug("[%s] Device authenticated.", self._host)
+                self.hass.data[DATA_SESSIONS].save(self._hysen_device)
             else:
                 _LOGGER.debug("[%s] Device not authenticated.", self._host)
         except Exception as exc:
@@ -863,19 +1077,150 @@ class HysenHeating(ClimateDevice):
         """Get device status."""
         await self._try_command(
             "Error in get_device_status", 
-            self._hysen_device.get_device_status)
+            self._hysen_device.async_get_device_status)
+
+    async def async_poll_device_status(self, priority = HYSEN_HEAT_PRIORITY_POLL):
+        """Get device status, the clock and schedule only when due. Returns True if they were read."""
+        self._device_available = True
+        try:
+            return await self._hysen_device.async_poll_status(priority)
+        except Exception as exc:
+            if exc.args and (exc.args[0] == 'hysen_circuit_open'):
+                # already reported when the breaker opened
+                _LOGGER.debug("[%s] Error in poll_status: %s", self._host, exc)
+            else:
+                _LOGGER.error("[%s] Error in poll_status: %s", self._host, exc)
+            self._device_available = False
+            if self._hysen_device.session_rejected(exc):
+                _LOGGER.debug("[%s] Session rejected, authenticating again.", self._host)
+                self._device_authenticated = False
+                self.hass.data[DATA_SESSIONS].discard(self._hysen_device)
+        return False
+
+    async def async_added_to_hass(self):
+        """Index the entity for the services, subscribe to the fleet coordinator, which polls the device."""
+        self._indexed_entity_id = self.entity_id
+        self.hass.data[DATA_ENTITY_IDS][self.entity_id] = self
+        self._unsub_poll = self.hass.data[DATA_COORDINATOR].subscribe(
+            self._host, 
+            self._async_poll, 
+            self._poll_interval.interval)
+
+    async def async_will_remove_from_hass(self):
+        """Stop polling and close the device transport when the entity is removed."""
+        self.hass.data[DATA_ENTITY_IDS].pop(self._indexed_entity_id, None)
+        self._commands.close()
+        if self._unsub_poll is not None:
+            self._unsub_poll()
+            self._unsub_poll = None
+        if self._unsub_reconcile is not None:
+            self._unsub_reconcile()
+            self._unsub_reconcile = None
+        self._hysen_device.close()
+
+    async def _async_poll(self):
+        """Update the device, write the state only if it changed or the heartbeat is due."""
+        if self._polling:
+            return
+        self._polling = True
+        previous_status = self._hysen_device.status
+        try:
+            await self.async_update()
+        finally:
+            self._polling = False
+        self._adapt_poll_interval(previous_status)
+        self._async_publish_state()
+
+    def _adapt_poll_interval(self, previous_status):
+        """Poll often while the device is active, back off while it is stable."""
+        now = time.monotonic()
+        elapsed = None if self._poll_time is None else (now - self._poll_time)
+        self._poll_time = now
+        changes = self._hysen_device.status.diff(previous_status)
+        active = ('valve_state' in changes) or \
+                 ('target_temp' in changes) or \
+                 ('operation_mode' in changes) or \
+                 ('power_state' in changes)
+        if ('room_temp' in changes) and (elapsed is not None):
+            old_temp, new_temp = changes['room_temp']
+            active = active or ((abs(new_temp - old_temp) * 3600 / elapsed) >= ROOM_TEMP_ACTIVE_RATE)
+        # a failed poll is tried again after scan_interval, not after the backed off interval,
+        # the circuit breaker keeps the polls of an unreachable device cheap
+        if active or not self._device_available:
+            self._poll_activity()
+        else:
+            self._poll_interval.stable()
+            self.hass.data[DATA_COORDINATOR].set_interval(self._host, self._poll_interval.interval)
+
+    def _poll_activity(self):
+        """Poll the device again soon, it is active or just received a command."""
+        self._poll_interval.activity()
+        self.hass.data[DATA_COORDINATOR].set_interval(self._host, self._poll_interval.interval)
+
+    @callback
+    def _async_publish_state(self):
+        """Write the state if the register snapshot or the availability changed, or the heartbeat is due."""
+        state = (self._device_available, self._hysen_device.status)
+        now = time.monotonic()
+        if (state == self._published_state) and \
+           ((now - self._published_time) < self._heartbeat):
+            return
+        self._published_state = state
+        self._published_time = now
+        self.async_schedule_update_ha_state()
+        async_dispatcher_send(self.hass, SIGNAL_HYSEN_HEATING_UPDATED.format(self._host))
 
     async def _try_command(self, mask_error, func, *args, **kwargs):
         """Calls a device command and handle error messages."""
+        if asyncio.iscoroutinefunction(func):
+            await self._try_async_command(mask_error, func, *args, **kwargs)
+        else:
+            await self._try_transaction(mask_error, [(partial(func, *args, **kwargs),)])
+
+    async def _try_transaction(self, mask_error, calls, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
+        """Calls device setters, given as (setter, *args) tuples, in one transaction. Publishes the outcome at once. Returns the error, None on success."""
+        error = await self._try_async_command(mask_error, self._async_commit, calls, priority)
+        # the register image already holds the writes the device confirmed
+        self._async_publish_state()
+        if self._device_available and (priority == HYSEN_HEAT_PRIORITY_INTERACTIVE):
+            self._schedule_reconcile()
+        return error
+
+    @callback
+    def _schedule_reconcile(self):
+        """Read the device again shortly, the latest of several commands only."""
+        if self._unsub_reconcile is not None:
+            self._unsub_reconcile()
+        self._unsub_reconcile = async_call_later(self.hass, RECONCILE_DELAY, self._async_reconcile)
+
+    async def _async_reconcile(self, now):
+        """Correct the optimistic state if the device diverged from the writes."""
+        self._unsub_reconcile = None
+        await self.async_poll_device_status(HYSEN_HEAT_PRIORITY_VERIFY)
+        self._async_publish_state()
+
+    async def _async_commit(self, calls, priority):
+        """Commit the writes of device setters in one transaction, its requests in the given priority class."""
+        async with self._hysen_device.transaction(priority):
+            for call in calls:
+                call[0](*call[1:])
+        if priority == HYSEN_HEAT_PRIORITY_INTERACTIVE:
+            self._poll_activity()
+
+    async def _try_async_command(self, mask_error, func, *args, **kwargs):
+        """Awaits a device coroutine and handle error messages. Returns the error, None on success."""
         self._device_available = True
         try:
-            await self.hass.async_add_executor_job(partial(func, *args, **kwargs))
+            await func(*args, **kwargs)
         except socket.timeout as timeout_error:
             _LOGGER.error("[%s] %s: %s", self._host, mask_error, timeout_error)
             self._device_available = False
+            return timeout_error
         except Exception as exc:
             _LOGGER.error("[%s] %s: %s", self._host, mask_error, exc)
             self._device_available = False
+            return exc
+        return None
 
     async def async_update(self):
         """Get the latest state from the device."""
@@ -886,14 +1231,29 @@ class HysenHeating(ClimateDevice):
             if self._device_available:
                 self._device_authenticated = True
         if self._device_authenticated:
-            await self.async_get_device_status()
+            _full_status = await self.async_poll_device_status()
             # Some devices don't have battery backup. Make sure the time is right.
-            _weekday = int(dt_util.as_local(dt_util.now()).strftime('%w'))
-            if self._device_available:
-                if _weekday == 0:
-                    _weekday = 7
-                if (self._hysen_device.clock_weekday != _weekday) or \
-                   (self._hysen_device.clock_hour != int(dt_util.as_local(dt_util.now()).strftime('%H'))) or \
-                   (self._hysen_device.clock_min != int(dt_util.as_local(dt_util.now()).strftime('%M'))):
-                    await self.async_set_time_now()
-       
+            # The clock is only read along with all the other registers.
+            if self._device_available and _full_status:
+                self._check_clock()
+
+    def _check_clock(self):
+        """Track the device clock, have it set with the fleet's next maintenance batch once its predicted error is too large."""
+        now = time.monotonic()
+        status = self._hysen_device.status
+        self._clock.sample(
+            now, 
+            dt_util.as_local(dt_util.now()), 
+            status.clock_weekday, 
+            status.clock_hour, 
+            status.clock_min, 
+            status.clock_sec)
+        # the clock is read again along with the cold registers
+        if self._clock.needs_sync(now + self._hysen_device.cold_interval):
+            _LOGGER.debug("[%s] Device clock off by %s s, drift %s s/s.", 
+                self._host, 
+                self._clock.offset, 
+                self._clock.drift)
+            self.hass.data[DATA_COORDINATOR].schedule_maintenance(
+                self._host, 
+                partial(self.async_set_time_now, HYSEN_HEAT_PRIORITY_MAINTENANCE))
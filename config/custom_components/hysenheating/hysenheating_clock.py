@@ -0,0 +1,77 @@
+"""
+Hysen Heating Thermostat Controller clock drift model
+Hysen HY03-1-Wifi device and derivative
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+HYSEN_CLOCK_WEEK = 7 * 24 * 3600
+
+# seconds of predicted clock error from which the device clock is set again
+HYSEN_CLOCK_DEFAULT_THRESHOLD = 30
+# seconds between the first and the last sample before a drift rate is estimated
+HYSEN_CLOCK_MIN_DRIFT_SPAN = 3600
+
+# Seconds since Monday 00:00:00 of a weekly clock, weekday 1 (Monday) to 7 (Sunday)
+def hysen_clock_seconds(weekday, hour, minute, second):
+    return ((weekday - 1) * 86400 + hour * 3600 + minute * 60 + second) % HYSEN_CLOCK_WEEK
+
+class HysenHeatingClock(object):
+    """Offset and drift of a thermostat clock against local time.
+
+    The device clock is sampled on each full status read. Its offset is kept
+    along with a drift rate estimated since the last sync, so that a sync is
+    only asked for once the error predicted for the next check passes the
+    threshold. A reading taken a few seconds before a minute boundary doesn't
+    look like a wrong clock anymore.
+    """
+
+    def __init__(self, threshold = HYSEN_CLOCK_DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.offset = None
+        self.drift = 0.0
+        self._time = None
+        self._base_time = None
+        self._base_offset = None
+
+    # Records a reading of the device clock, taken at monotonic time t, local_now being the local
+    # time (a datetime) at that moment
+    def sample(self, t, local_now, weekday, hour, minute, second):
+        device_seconds = hysen_clock_seconds(weekday, hour, minute, second)
+        local_seconds = hysen_clock_seconds(
+            local_now.isoweekday(),
+            local_now.hour,
+            local_now.minute,
+            local_now.second)
+        # wrapped into half a week either way
+        offset = ((device_seconds - local_seconds + HYSEN_CLOCK_WEEK // 2) % HYSEN_CLOCK_WEEK) - \
+                 HYSEN_CLOCK_WEEK // 2
+        if (self._base_time is None) or \
+           (abs(offset - self.predicted_error(t)) >= self.threshold):
+            # first reading, or a step (power cycle, DST change): no drift can be told from it
+            self._base_time = t
+            self._base_offset = offset
+        elif (t - self._base_time) >= HYSEN_CLOCK_MIN_DRIFT_SPAN:
+            self.drift = (offset - self._base_offset) / (t - self._base_time)
+        self.offset = offset
+        self._time = t
+
+    # Error of the device clock, seconds, predicted at monotonic time t
+    def predicted_error(self, t):
+        if self.offset is None:
+            return 0.0
+        return self.offset + self.drift * (t - self._time)
+
+    # Tells whether the clock has to be set before monotonic time t, the next check
+    def needs_sync(self, t):
+        return (self.offset is not None) and (abs(self.predicted_error(t)) >= self.threshold)
+
+    # The device clock was set at monotonic time t, the drift rate is kept
+    def synced(self, t):
+        self.offset = 0
+        self._time = t
+        self._base_time = t
+        self._base_offset = 0
@@ -0,0 +1,314 @@
+"""
+Hysen Heating Thermostat Controller fleet poll coordinator
+Hysen HY03-1-Wifi device and derivative
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# polls running at the same time, fleet wide
+HYSEN_COORDINATOR_DEFAULT_PARALLEL = 4
+
+# fraction of the interval between the phases of two members subscribed one after the other
+# (golden ratio), however many members there are the phases stay evenly spread
+HYSEN_COORDINATOR_PHASE_STEP = 0.6180339887
+
+# seconds maintenance jobs are collected before they run as one batch
+HYSEN_COORDINATOR_MAINTENANCE_DELAY = 10
+
+class HysenHeatingPollInterval(object):
+    """Adaptive poll interval of one device.
+
+    Back to min_interval as soon as the device is active, doubled after each
+    quiet poll, never above max_interval.
+    """
+
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min_interval
+
+    def activity(self):
+        self.interval = self.min_interval
+
+    def stable(self):
+        self.interval = min(self.interval * 2, self.max_interval)
+
+# seconds commands are collected after the last one before they are written together, 
+# and at most after the first one
+HYSEN_COALESCER_DEFAULT_DELAY = 0.5
+HYSEN_COALESCER_DEFAULT_MAX_DELAY = 2.0
+
+class HysenHeatingCommandCoalescer(object):
+    """Debounced commands of one device.
+
+    The commands submitted within delay seconds of each other are merged into
+    one desired state, the latest value of each field winning, and written
+    once by async_commit(state). The fields of state are in the order they
+    were last submitted. Every caller waits for that write and gets
+    its result, or its exception. A steady stream of commands is still written
+    max_delay seconds after the first one. close() cancels the commands not
+    written yet and the writes in progress.
+    """
+
+    def __init__(self, async_commit, 
+                 delay = HYSEN_COALESCER_DEFAULT_DELAY, 
+                 max_delay = HYSEN_COALESCER_DEFAULT_MAX_DELAY):
+        self._async_commit = async_commit
+        self._delay = delay
+        self._max_delay = max_delay
+        self._state = {}
+        self._future = None
+        self._handle = None
+        self._deadline = None
+        self._tasks = set()
+        self.submitted = 0
+        self.committed = 0
+
+    async def async_submit(self, **state):
+        loop = asyncio.get_event_loop()
+        self.submitted += 1
+        for field, value in state.items():
+            # moved last, the order of the latest calls is kept
+            self._state.pop(field, None)
+            self._state[field] = value
+        if self._future is None:
+            self._future = loop.create_future()
+            self._deadline = loop.time() + self._max_delay
+        else:
+            self._handle.cancel()
+        self._handle = loop.call_at(
+            min(loop.time() + self._delay, self._deadline), 
+            self._flush)
+        return await asyncio.shield(self._future)
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        self._state = {}
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _flush(self):
+        state = self._state
+        future = self._future
+        self._state = {}
+        self._future = None
+        self._handle = None
+        # kept until done, a task nothing refers to may be garbage collected while it runs
+        task = asyncio.ensure_future(self._async_flush(state, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _async_flush(self, state, future):
+        self.committed += 1
+        try:
+            result = await self._async_commit(state)
+        except Exception as exc:
+            future.set_exception(exc)
+            # retrieved, the callers may have gone
+            future.exception()
+        except BaseException:
+            # cancelled, the callers mustn't wait forever
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+
+class HysenHeatingCoordinatorMember(object):
+    """A device polled by the coordinator."""
+
+    __slots__ = ('key', 'async_poll', 'interval', 'phase', 'due', 'running', 'active')
+
+    def __init__(self, key, async_poll, interval, phase):
+        self.key = key
+        self.async_poll = async_poll
+        self.interval = interval
+        self.phase = phase
+        self.due = None
+        self.running = False
+        self.active = True
+
+class HysenHeatingCoordinator(object):
+    """Single scheduler polling a whole thermostat fleet.
+
+    Each member is polled every interval seconds at its own phase offset, so the
+    reads of the fleet are spread over the interval instead of all firing in the
+    same tick. At most parallel polls run at the same time. A member whose
+    previous poll is still running skips its turn.
+    """
+
+    def __init__(self, parallel = HYSEN_COORDINATOR_DEFAULT_PARALLEL):
+        self._parallel = parallel
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+        self._heap = []
+        self._members = {}
+        self._sequence = itertools.count()
+        self._subscribed = 0
+        self._running = 0
+        self._idle = None
+        self._maintenance = {}
+        self._maintenance_handle = None
+        # poll and maintenance tasks in progress
+        self._tasks = set()
+        self.skipped = 0
+
+    # Polls async_poll() every interval seconds, the first time as soon as a poll slot is free
+    # Returns a callable which unsubscribes the member
+    def subscribe(self, key, async_poll, interval):
+        self.unsubscribe(key)
+        phase = ((self._subscribed * HYSEN_COORDINATOR_PHASE_STEP) % 1.0) * interval
+        self._subscribed += 1
+        member = HysenHeatingCoordinatorMember(key, async_poll, interval, phase)
+        self._members[key] = member
+        self._start()
+        self._schedule(member, asyncio.get_event_loop().time())
+        return lambda: self.unsubscribe(key)
+
+    # Changes the poll interval of a member
+    # A shorter interval brings the next poll forward if it was due later than interval from now, 
+    # a longer one takes effect after the next poll
+    def set_interval(self, key, interval):
+        member = self._members.get(key)
+        if (member is None) or (member.interval == interval):
+            return
+        member.interval = interval
+        member.phase = None
+        due = asyncio.get_event_loop().time() + interval
+        if (member.due is not None) and (due < member.due):
+            # the former heap entry no longer matches member.due, it is dropped when it comes due
+            self._schedule(member, due)
+
+    # Runs async_job() at the next quiet moment, along with the jobs of the other members queued by then
+    # The batch waits for the polls in progress and runs with the same concurrency cap
+    # A member has one maintenance job queued at most, the latest given
+    def schedule_maintenance(self, key, async_job):
+        self._start()
+        self._maintenance[key] = async_job
+        if self._maintenance_handle is None:
+            self._maintenance_handle = asyncio.get_event_loop().call_later(
+                HYSEN_COORDINATOR_MAINTENANCE_DELAY, 
+                self._start_maintenance)
+
+    def unsubscribe(self, key):
+        self._maintenance.pop(key, None)
+        member = self._members.pop(key, None)
+        if member is not None:
+            # its heap entry is dropped when it comes due
+            member.active = False
+
+    def close(self):
+        for key in list(self._members):
+            self.unsubscribe(key)
+        if self._maintenance_handle is not None:
+            self._maintenance_handle.cancel()
+            self._maintenance_handle = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    def _start(self):
+        if self._task is None:
+            self._semaphore = asyncio.Semaphore(self._parallel)
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._task = asyncio.ensure_future(self._async_run())
+
+    # Runs a coroutine in a task kept until it is done, so that it isn't garbage collected 
+    # while it runs and close() can cancel it
+    def _create_task(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _schedule(self, member, due):
+        member.due = due
+        heapq.heappush(self._heap, (due, next(self._sequence), member))
+        if self._heap[0][2] is member:
+            self._wakeup.set()
+
+    # Next due time of a member after its poll due at due
+    # The first poll is followed by the member's phase slot, then one every interval
+    def _next_due(self, member, due):
+        if member.phase is None:
+            return due + member.interval
+        next_due = due + member.phase
+        if member.phase < (member.interval / 2):
+            next_due += member.interval
+        member.phase = None
+        return next_due
+
+    async def _async_run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            due, _, member = self._heap[0]
+            delay = due - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            if (not member.active) or (member.due != due):
+                # unsubscribed or rescheduled since
+                continue
+            # fixed rate keeps the phase, unless the loop fell a whole interval behind
+            self._schedule(member, max(self._next_due(member, due), loop.time()))
+            if member.running:
+                self.skipped += 1
+                _LOGGER.debug("Skipping poll of %s, the previous one is still running.", member.key)
+                continue
+            member.running = True
+            self._create_task(self._async_poll(member))
+
+    async def _async_poll(self, member):
+        self._running += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                await member.async_poll()
+        except Exception as exc:
+            _LOGGER.error("Error polling %s: %s", member.key, exc)
+        finally:
+            member.running = False
+            self._running -= 1
+            if self._running == 0:
+                self._idle.set()
+
+    def _start_maintenance(self):
+        self._maintenance_handle = None
+        jobs = self._maintenance
+        self._maintenance = {}
+        self._create_task(self._async_run_maintenance(jobs))
+
+    async def _async_run_maintenance(self, jobs):
+        await self._idle.wait()
+        _LOGGER.debug("Running %s maintenance jobs.", len(jobs))
+        await asyncio.gather(
+            *[self._async_maintenance(key, async_job) for key, async_job in jobs.items()])
+
+    async def _async_maintenance(self, key, async_job):
+        try:
+            async with self._semaphore:
+                await async_job()
+        except Exception as exc:
+            _LOGGER.error("Error in maintenance of %s: %s", key, exc)
@@ -5,11 +5,33 @@ http://www.xmhysen.com/products_detail/productId=197.html
 """
 
 from broadlink import device
+import asyncio
 import logging
+import operator
+import random
+import socket
+import struct
+import time
 from PyCRC.CRC16 import CRC16
 
+from .hysenheating_transport import (
+    HysenHeatingTransport, 
+    HysenHeatingRtt, 
+    HysenHeatingDiscovery, 
+    HysenHeatingCircuitBreaker, 
+    HysenHeatingRequestQueue, 
+    HYSEN_CIRCUIT_OPEN, 
+    HYSEN_CIRCUIT_HALF_OPEN, 
+    HYSEN_PRIORITY_INTERACTIVE, 
+    HYSEN_PRIORITY_VERIFY, 
+    HYSEN_PRIORITY_POLL, 
+    HYSEN_PRIORITY_MAINTENANCE
+)
+
 _LOGGER = logging.getLogger(__name__)
 
+HYSEN_HEAT_DEVTYPE              = 0x4EAD
+
 HYSEN_HEAT_REMOTE_LOCK_OFF      = 0
 HYSEN_HEAT_REMOTE_LOCK_ON       = 1
 
@@ -52,62 +74,418 @@ HYSEN_HEAT_DEFAULT_TARGET_TEMP  = 22
 HYSEN_HEAT_DEFAULT_HYSTERESIS   = 2
 HYSEN_HEAT_DEFAULT_CALIBRATION  = 0.0
 
+# seconds the shadow register image is trusted by the setters before it is read again
+HYSEN_HEAT_DEFAULT_STATUS_TTL   = 10
+
+# tiered status reads
+# the hot words (lock, power, valve, room and target temperature, mode, sensor, options, 
+# external temperature) are read on every poll, the cold ones (clock, schedule) only every 
+# cold_interval seconds, after a write to them, or when a full read is asked for
+HYSEN_HEAT_HOT_WORDS            = 0x08
+HYSEN_HEAT_STATUS_WORDS         = 0x17
+HYSEN_HEAT_DEFAULT_COLD_INTERVAL = 300
+
+# requests kept in flight per device on the asyncio transport
+HYSEN_HEAT_DEFAULT_WINDOW       = 2
+
+# priority classes of the requests on the asyncio transport, most urgent first
+# interactive: user commands, verify: reads checking a command, poll: routine status reads, 
+# maintenance: clock sync and other background writes
+HYSEN_HEAT_PRIORITY_INTERACTIVE = HYSEN_PRIORITY_INTERACTIVE
+HYSEN_HEAT_PRIORITY_VERIFY      = HYSEN_PRIORITY_VERIFY
+HYSEN_HEAT_PRIORITY_POLL        = HYSEN_PRIORITY_POLL
+HYSEN_HEAT_PRIORITY_MAINTENANCE = HYSEN_PRIORITY_MAINTENANCE
+
+# retries of a request on the asyncio transport
+HYSEN_HEAT_DEFAULT_RETRIES      = 2
+# bounds and initial value of a single attempt timeout, seconds 
+# the upper bound is the configured device timeout
+HYSEN_HEAT_MIN_RTO              = 0.2
+HYSEN_HEAT_INITIAL_RTO          = 1.0
+# base of the jittered exponential delay between retries, seconds
+HYSEN_HEAT_RETRY_BACKOFF        = 0.05
+
+# circuit breaker: consecutive failed requests opening it, seconds it stays open 
+# before a probe, doubled after each failed probe up to the maximum
+HYSEN_HEAT_CIRCUIT_FAILURES     = 3
+HYSEN_HEAT_CIRCUIT_OPEN_TIME    = 30
+HYSEN_HEAT_CIRCUIT_MAX_OPEN_TIME = 600
+
+# seconds discovery waits for the answers to its broadcast
+HYSEN_HEAT_DEFAULT_DISCOVERY_TIMEOUT = 5
+# discovered devices authenticated at the same time
+HYSEN_HEAT_DEFAULT_DISCOVERY_PARALLEL = 16
+
+# device id and AES key a handshake is sent with, those of broadlink.device before authentication
+HYSEN_HEAT_AUTH_ID              = bytes([0x00, 0x00, 0x00, 0x00])
+HYSEN_HEAT_AUTH_KEY             = bytes([0x09, 0x76, 0x28, 0x34, 0x3f, 0xe9, 0x9e, 0x23, 
+                                         0x76, 0x5c, 0x15, 0x13, 0xac, 0xcf, 0x8b, 0x02])
+
+HYSEN_HEAT_ERROR_LENGTH         = 'first byte of response is not length'
+HYSEN_HEAT_ERROR_CRC            = 'CRC check on response failed'
+
+HYSEN_HEAT_RETRY_TIMEOUT        = 'timeout'
+HYSEN_HEAT_RETRY_CRC            = 'crc'
+HYSEN_HEAT_RETRY_BROADLINK      = 'broadlink_response_error'
+
+# writable bits of each byte of the register image
+# the valve and manual over auto flags, the room temperature and the external temperature 
+# are reported by the device, whatever a write request carries for them is ignored
+HYSEN_HEAT_REGISTERS_WRITE_MASK = bytearray([0xFF, 0xAF, 0x00, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 
+                                             0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00]) + \
+                                  bytearray([0xFF] * 30)
+
+# Register map of the device memory data (0x17 words, big endian)
+# attribute, byte offset, struct format (B = unsigned byte, h = signed word), bit shift, bit mask, scale
+# attribute = ((raw >> shift) & mask) / scale, a float if scale is given
+# raw = (int(attribute * scale) & mask) << shift when encoding a write request
+HYSEN_HEAT_REGISTERS = [
+    ('remote_lock',         0x00, 'B', 0, 0x01, None),
+    ('manual_over_auto',    0x01, 'B', 6, 0x01, None),
+    ('valve_state',         0x01, 'B', 4, 0x01, None),
+    ('power_state',         0x01, 'B', 0, 0x01, None),
+    ('room_temp',           0x02, 'B', 0, 0xFF, 2.0),
+    ('target_temp',         0x03, 'B', 0, 0xFF, 2.0),
+    ('operation_mode',      0x04, 'B', 0, 0x0F, None),
+    ('schedule',            0x04, 'B', 4, 0x0F, None),
+    ('sensor',              0x05, 'B', 0, 0xFF, None),
+    ('external_limit_temp', 0x06, 'B', 0, 0xFF, 1.0),
+    ('hysteresis',          0x07, 'B', 0, 0xFF, None),
+    ('max_temp',            0x08, 'B', 0, 0xFF, None),
+    ('min_temp',            0x09, 'B', 0, 0xFF, None),
+    ('calibration',         0x0A, 'h', 0, None, 2.0),
+    ('frost_protection',    0x0C, 'B', 0, 0xFF, None),
+    ('poweron',             0x0D, 'B', 0, 0xFF, None),
+    ('unknown1',            0x0E, 'B', 0, 0xFF, None),
+    ('external_temp',       0x0F, 'B', 0, 0xFF, 2.0),
+    ('clock_hour',          0x10, 'B', 0, 0xFF, None),
+    ('clock_min',           0x11, 'B', 0, 0xFF, None),
+    ('clock_sec',           0x12, 'B', 0, 0xFF, None),
+    ('clock_weekday',       0x13, 'B', 0, 0xFF, None),
+    ('period1_hour',        0x14, 'B', 0, 0xFF, None),
+    ('period1_min',         0x15, 'B', 0, 0xFF, None),
+    ('period2_hour',        0x16, 'B', 0, 0xFF, None),
+    ('period2_min',         0x17, 'B', 0, 0xFF, None),
+    ('period3_hour',        0x18, 'B', 0, 0xFF, None),
+    ('period3_min',         0x19, 'B', 0, 0xFF, None),
+    ('period4_hour',        0x1A, 'B', 0, 0xFF, None),
+    ('period4_min',         0x1B, 'B', 0, 0xFF, None),
+    ('period5_hour',        0x1C, 'B', 0, 0xFF, None),
+    ('period5_min',         0x1D, 'B', 0, 0xFF, None),
+    ('period6_hour',        0x1E, 'B', 0, 0xFF, None),
+    ('period6_min',         0x1F, 'B', 0, 0xFF, None),
+    ('we_period1_hour',     0x20, 'B', 0, 0xFF, None),
+    ('we_period1_min',      0x21, 'B', 0, 0xFF, None),
+    ('we_period6_hour',     0x22, 'B', 0, 0xFF, None),
+    ('we_period6_min',      0x23, 'B', 0, 0xFF, None),
+    ('period1_temp',        0x24, 'B', 0, 0xFF, 2.0),
+    ('period2_temp',        0x25, 'B', 0, 0xFF, 2.0),
+    ('period3_temp',        0x26, 'B', 0, 0xFF, 2.0),
+    ('period4_temp',        0x27, 'B', 0, 0xFF, 2.0),
+    ('period5_temp',        0x28, 'B', 0, 0xFF, 2.0),
+    ('period6_temp',        0x29, 'B', 0, 0xFF, 2.0),
+    ('we_period1_temp',     0x2A, 'B', 0, 0xFF, 2.0),
+    ('we_period6_temp',     0x2B, 'B', 0, 0xFF, 2.0),
+    ('unknown2',            0x2C, 'B', 0, 0xFF, None),
+    ('unknown3',            0x2D, 'B', 0, 0xFF, None),
+]
+
+# Compiles the register map into one struct.Struct covering the register image, 
+# a list of (attribute, struct item index, shift, mask, scale) for encoding 
+# and a decoding plan: attributes read as is, scaled ones, bit fields
+def _compile_registers(registers):
+    offsets = sorted(set((offset, fmt) for _, offset, fmt, _, _, _ in registers))
+    items = {}
+    fmt = '>'
+    position = 0
+    for offset, code in offsets:
+        fmt += 'x' * (offset - position) + code
+        items[offset] = len(items)
+        position = offset + struct.calcsize('>' + code)
+    fmt += 'x' * (2 * HYSEN_HEAT_STATUS_WORDS - position)
+    fields = []
+    plain = []
+    scaled = []
+    bits = []
+    for name, offset, code, shift, mask, scale in registers:
+        fields.append((name, items[offset], shift, mask, scale))
+        # a full byte mask without shift is a no-op on an unsigned byte
+        if (code == 'B') and (shift == 0) and (mask == 0xFF):
+            mask = None
+        if mask is not None:
+            bits.append((name, items[offset], shift, mask, scale))
+        elif scale is not None:
+            scaled.append((name, items[offset], scale))
+        else:
+            plain.append((name, items[offset]))
+    names = [field[0] for field in plain + scaled + bits]
+    return struct.Struct(fmt), fields, (names, 
+        operator.itemgetter(*[field[1] for field in plain]), 
+        operator.itemgetter(*[field[1] for field in scaled]), 
+        [field[2] for field in scaled], 
+        [field[1:] for field in bits])
+
+HYSEN_HEAT_REGISTERS_STRUCT, HYSEN_HEAT_REGISTERS_FIELDS, _HYSEN_HEAT_DECODER = \
+    _compile_registers(HYSEN_HEAT_REGISTERS)
+HYSEN_HEAT_REGISTERS_ITEMS = len(set(register[1] for register in HYSEN_HEAT_REGISTERS))
+HYSEN_HEAT_REGISTERS_BY_NAME = {field[0]: field for field in HYSEN_HEAT_REGISTERS_FIELDS}
+# attributes in the order hysen_heat_decode_registers returns their values
+HYSEN_HEAT_FIELD_NAMES = _HYSEN_HEAT_DECODER[0]
+
+# Decodes a register image in a single unpack_from
+# Returns the attribute values, in HYSEN_HEAT_FIELD_NAMES order
+def hysen_heat_decode_registers(registers):
+    _, plain, scaled, scales, bits = _HYSEN_HEAT_DECODER
+    raw = HYSEN_HEAT_REGISTERS_STRUCT.unpack_from(registers)
+    values = list(plain(raw))
+    values.extend(map(operator.truediv, scaled(raw), scales))
+    for index, shift, mask, scale in bits:
+        if scale is None:
+            values.append((raw[index] >> shift) & mask)
+        else:
+            values.append(((raw[index] >> shift) & mask) / scale)
+    return values
+
+# Encodes attribute values into the bytes of count words starting at word start
+# Bits not covered by the given values are zero
+def hysen_heat_encode_registers(start, count, **values):
+    raw = [0] * HYSEN_HEAT_REGISTERS_ITEMS
+    for name, value in values.items():
+        _, index, shift, mask, scale = HYSEN_HEAT_REGISTERS_BY_NAME[name]
+        value = int(value * scale) if scale is not None else int(value)
+        if mask is not None:
+            value = (value & mask) << shift
+        raw[index] |= value
+    return HYSEN_HEAT_REGISTERS_STRUCT.pack(*raw)[2 * start:2 * (start + count)]
+
+# Builds the write request of count words starting at word start
+# 0x06 (write word) for a single word, 0x10 (write several words) otherwise
+def hysen_heat_write_request(start, count, **values):
+    if count == 1:
+        _request = bytearray([0x01, 0x06, 0x00, start])
+    else:
+        _request = bytearray([0x01, 0x10, 0x00, start, 0x00, count, 2 * count])
+    _request.extend(hysen_heat_encode_registers(start, count, **values))
+    return _request
+
+class HysenHeatingStatus(object):
+    """Immutable snapshot of the device registers.
+
+    A bytes backed view over the register image, with one read-only property per
+    register field, decoded on first access. Two snapshots are equal when their 
+    register images are.
+    """
+
+    __slots__ = ('_registers', '_values')
+
+    def __init__(self, registers):
+        self._registers = bytes(registers)
+        self._values = None
+
+    @property
+    def registers(self):
+        return self._registers
+
+    def _decoded(self):
+        if self._values is None:
+            self._values = tuple(hysen_heat_decode_registers(self._registers))
+        return self._values
+
+    def __eq__(self, other):
+        return isinstance(other, HysenHeatingStatus) and (self._registers == other._registers)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._registers)
+
+    def __repr__(self):
+        return 'HysenHeatingStatus(%s)' % self._registers.hex()
+
+    # Returns {field: (previous value, value)} of the fields which differ from the previous snapshot
+    # All the fields if previous is None
+    def diff(self, previous):
+        if previous is None:
+            return {name: (None, value) for name, value in zip(HYSEN_HEAT_FIELD_NAMES, self._decoded())}
+        if self._registers == previous._registers:
+            return {}
+        return {name: (old, new) 
+            for name, old, new in zip(HYSEN_HEAT_FIELD_NAMES, previous._decoded(), self._decoded()) 
+            if old != new}
+
+for _index, _name in enumerate(HYSEN_HEAT_FIELD_NAMES):
+    setattr(HysenHeatingStatus, _name, property(lambda self, _index = _index: self._decoded()[_index]))
+
+# register image before the first status read
+HYSEN_HEAT_DEFAULT_REGISTERS = hysen_heat_encode_registers(
+    0x00, HYSEN_HEAT_STATUS_WORDS, 
+    remote_lock = HYSEN_HEAT_REMOTE_LOCK_OFF,
+    valve_state = HYSEN_HEAT_VALVE_OFF,
+    power_state = HYSEN_HEAT_POWER_ON,
+    manual_over_auto = HYSEN_HEAT_MANUAL_OVER_AUTO_OFF,
+    target_temp = HYSEN_HEAT_DEFAULT_TARGET_TEMP,
+    operation_mode = HYSEN_HEAT_MODE_MANUAL,
+    schedule = HYSEN_HEAT_SCHEDULE_1234567,
+    sensor = HYSEN_HEAT_SENSOR_INTERNAL,
+    external_limit_temp = HYSEN_HEAT_DEFAULT_TARGET_TEMP,
+    hysteresis = HYSEN_HEAT_DEFAULT_HYSTERESIS,
+    max_temp = HYSEN_HEAT_MAX_TEMP,
+    min_temp = HYSEN_HEAT_MIN_TEMP,
+    calibration = HYSEN_HEAT_DEFAULT_CALIBRATION,
+    frost_protection = HYSEN_HEAT_FROST_PROTECTION_OFF,
+    poweron = HYSEN_HEAT_POWERON_OFF,
+    clock_weekday = 1)
+
+class HysenHeatingTransaction(object):
+    """Batch of setter writes committed together, see HysenHeatingDevice.transaction."""
+
+    def __init__(self, device, priority):
+        self._device = device
+        self._priority = priority
+        self._registers = None
+        self._words = {}
+        # words only written if they differ from the shadow register image
+        self._delta_words = set()
+
+    def __enter__(self):
+        self._device._refresh_status()
+        self._begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for request in self._end(exc_type is None):
+            self._device.send_request(request)
+        return False
+
+    # Asyncio transactions of a device run one at a time, in priority order, from the refresh 
+    # of the shadow register image to the last write of the commit
+    async def __aenter__(self):
+        await self._device._serial.acquire(self._priority)
+        try:
+            await self._device._async_refresh_status(self._priority)
+            self._begin()
+        except BaseException:
+            self._device._serial.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            for request in self._end(exc_type is None):
+                await self._device.async_send_request(request, self._priority)
+        finally:
+            self._device._serial.release()
+        return False
+
+    def _begin(self):
+        if self._device._transaction is not None:
+            raise ValueError('hysen_transaction_error', 'a transaction is already open')
+        self._registers = bytes(self._device._registers)
+        self._device._transaction = self
+
+    # Collects a write request instead of sending it
+    # The words of a delta write are left out of the commit if they match the shadow register
+    # image, the words of any other write are always sent
+    # Returns the response the device would confirm the write with
+    def add(self, input_payload, delta = False):
+        words = self._device._request_words(input_payload)
+        if words is None:
+            raise ValueError('hysen_transaction_error', 'only writes can be part of a transaction')
+        for i in range(0, len(words[1]), 2):
+            word = words[0] + i // 2
+            if delta and ((word in self._delta_words) or (word not in self._words)):
+                self._delta_words.add(word)
+            else:
+                self._delta_words.discard(word)
+            self._words[word] = words[1][i:i + 2]
+        self._device._update_registers(input_payload)
+        if input_payload[1] == 0x10:
+            return input_payload[0:6]
+        return input_payload
+
+    # Closes the transaction, restores the shadow register image as it was before
+    # Returns the write requests to commit
+    def _end(self, commit):
+        self._device._transaction = None
+        self._device._registers[:] = self._registers
+        self._device._decode_registers()
+        if not commit:
+            return []
+        changed = [word for word in sorted(self._words) if self._changed(word)]
+        requests = []
+        while changed:
+            count = 1
+            while (count < len(changed)) and (changed[count] == changed[0] + count):
+                count += 1
+            data = b''.join(self._words[word] for word in changed[0:count])
+            if count == 1:
+                _request = bytearray([0x01, 0x06, 0x00, changed[0]])
+            else:
+                _request = bytearray([0x01, 0x10, 0x00, changed[0], 0x00, count, 2 * count])
+            _request.extend(data)
+            requests.append(_request)
+            changed = changed[count:]
+        return requests
+
+    def _changed(self, word):
+        if word not in self._delta_words:
+            return True
+        for i in range(2):
+            mask = HYSEN_HEAT_REGISTERS_WRITE_MASK[2 * word + i]
+            if (self._words[word][i] & mask) != (self._registers[2 * word + i] & mask):
+                return True
+        return False
+
 class HysenHeatingDevice(device):
     
-    def __init__ (self, host, mac, devtype, timeout):
+    def __init__ (self, host, mac, devtype, timeout, transport = None, window = HYSEN_HEAT_DEFAULT_WINDOW):
         device.__init__(self, host, mac, devtype, timeout)
         self.type = "Hysen Heating Thermostat Controller"
         self._host = host[0]
+        # transport may be shared by the whole fleet, otherwise the device opens its own
+        self._transport = transport
+        self._own_transport = False
+        # the socket broadlink opened is only needed by the blocking send_packet,
+        # a device on a shared transport opens it again on first use
+        if transport is not None:
+            self._close_socket()
+        self._queue = HysenHeatingRequestQueue(window)
+        # read-modify-write transactions, one at a time
+        self._serial = HysenHeatingRequestQueue(1)
+        # counts the confirmed writes, a read in flight across one is stale
+        self._write_generation = 0
+        # reads in progress with their priority class, identical reads not more urgent share the result
+        self._pending_reads = {}
+        self._rtt = HysenHeatingRtt(HYSEN_HEAT_MIN_RTO, timeout, HYSEN_HEAT_INITIAL_RTO)
+        self.retries = HYSEN_HEAT_DEFAULT_RETRIES
+        self.circuit = HysenHeatingCircuitBreaker(
+            HYSEN_HEAT_CIRCUIT_FAILURES, 
+            HYSEN_HEAT_CIRCUIT_OPEN_TIME, 
+            HYSEN_HEAT_CIRCUIT_MAX_OPEN_TIME)
+        # shadow copy of the device registers (0x17 words), used by the setters for read-modify-write
+        self.status_ttl = HYSEN_HEAT_DEFAULT_STATUS_TTL
+        self.cold_interval = HYSEN_HEAT_DEFAULT_COLD_INTERVAL
+        self._registers = None
+        self._hot_time = None
+        self._cold_time = None
+        # a confirmed write to the cold words has the next poll read all the words
+        self._cold_poll_due = False
+        self._transaction = None
+        self.stats = {
+            'requests': 0,
+            'failures': 0,
+            'retries': 0,
+            HYSEN_HEAT_RETRY_TIMEOUT: 0,
+            HYSEN_HEAT_RETRY_CRC: 0,
+            HYSEN_HEAT_RETRY_BROADLINK: 0,
+            'stale_reads': 0,
+        }
         
+        self.authenticated = False
         self.manual_target_temp = HYSEN_HEAT_DEFAULT_TARGET_TEMP
-        self.remote_lock = HYSEN_HEAT_REMOTE_LOCK_OFF
-        self.valve_state = HYSEN_HEAT_VALVE_OFF
-        self.power_state = HYSEN_HEAT_POWER_ON
-        self.manual_over_auto  = HYSEN_HEAT_MANUAL_OVER_AUTO_OFF
-        self.room_temp = 0        
-        self.target_temp = HYSEN_HEAT_DEFAULT_TARGET_TEMP
-        self.operation_mode = HYSEN_HEAT_MODE_MANUAL
-        self.schedule = HYSEN_HEAT_SCHEDULE_1234567
-        self.sensor = HYSEN_HEAT_SENSOR_INTERNAL
-        self.external_limit_temp = HYSEN_HEAT_DEFAULT_TARGET_TEMP
-        self.hysteresis = HYSEN_HEAT_DEFAULT_HYSTERESIS
-        self.max_temp = HYSEN_HEAT_MAX_TEMP
-        self.min_temp = HYSEN_HEAT_MIN_TEMP
-        self.calibration = HYSEN_HEAT_DEFAULT_CALIBRATION
-        self.frost_protection = HYSEN_HEAT_FROST_PROTECTION_OFF
-        self.poweron = HYSEN_HEAT_POWERON_OFF
-        self.unknown1 = 0
-        self.external_temp = 0
-        self.clock_hour = 0
-        self.clock_min = 0
-        self.clock_sec = 0
-        self.clock_weekday = 1
-        self.period1_hour = 0
-        self.period1_min = 0
-        self.period2_hour_hour = 0
-        self.period2_min = 0
-        self.period3_hour = 0
-        self.period3_min = 0
-        self.period4_hour = 0
-        self.period4_min = 0
-        self.period5_hour = 0
-        self.period5_min = 0
-        self.period6_hour = 0
-        self.period6_min = 0
-        self.we_period1_hour = 0
-        self.we_period1_min = 0
-        self.we_period6_hour = 0
-        self.we_period6_min = 0
-        self.period1_temp = 0
-        self.period2_temp = 0
-        self.period3_temp = 0
-        self.period4_temp = 0
-        self.period5_temp = 0
-        self.period6_temp = 0
-        self.we_period1_temp = 0
-        self.we_period6_temp = 0
-        self.unknown2 = 0
-        self.unknown3 = 0
+        # register fields (remote_lock, room_temp, ..., unknown3) are read from the latest snapshot
+        self.status = HysenHeatingStatus(HYSEN_HEAT_DEFAULT_REGISTERS)
 
     # Send a request
     # Returns decrypted payload
@@ -208,7 +586,234 @@ class HysenHeatingDevice(device):
     #        0x03 - Wrong length
     # New behavior: raises a ValueError if the device response indicates an error or CRC check fails
     # The function prepends length (2 bytes) and appends CRC
+    # A confirmed write is applied to the shadow register image, a failed one invalidates it
+    # While the circuit breaker is open, raises ValueError('hysen_circuit_open') at once
     def send_request(self, input_payload):
+        if self._transaction is not None:
+            return self._transaction.add(input_payload)
+        self._check_circuit()
+        try:
+            response = self.send_packet(0x6a, self._pack_request(input_payload))
+            return_payload = self._unpack_response(input_payload, response)
+        except Exception as exc:
+            self._circuit_failure(exc)
+            self._invalidate_registers(input_payload)
+            raise
+        self._confirm_request(input_payload)
+        return return_payload
+
+    # Asyncio counterpart of send_request
+    # The packet goes through a native datagram transport instead of the blocking broadlink socket
+    # A timeout, a corrupted response or a broadlink error is retried up to self.retries times,
+    # each attempt with the timeout given by the device RTT estimator, doubled on every retry, 
+    # after a jittered exponential delay. Every retry is counted in self.stats by its reason.
+    # The request probing a half open circuit breaker is a single attempt, if it is cancelled 
+    # the next request probes again.
+    # priority is the class the request waits in for a slot of the device window, see 
+    # HysenHeatingRequestQueue. A read identical to one still in progress in the same or a more
+    # urgent priority class is not sent again, it gets the result of the first one. If the first
+    # one is cancelled, the reads sharing it are sent again.
+    async def async_send_request(self, input_payload, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
+        if self._transaction is not None:
+            return self._transaction.add(input_payload)
+        if input_payload[0:2] != bytearray([0x01, 0x03]):
+            return await self._async_send_request(input_payload, priority)
+        key = bytes(input_payload)
+        while True:
+            pending = self._pending_reads.get(key)
+            if (pending is None) or (pending[0] > priority):
+                break
+            return_payload = await asyncio.shield(pending[1])
+            if return_payload is not None:
+                return return_payload
+        future = asyncio.get_event_loop().create_future()
+        self._pending_reads[key] = (priority, future)
+        try:
+            return_payload = await self._async_send_request(input_payload, priority)
+        except Exception as exc:
+            future.set_exception(exc)
+            # retrieved, so that a read nobody else waited for isn't reported as unhandled
+            future.exception()
+            raise
+        except BaseException:
+            # cancelled, None has the reads sharing it sent again
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(return_payload)
+            return return_payload
+        finally:
+            if self._pending_reads.get(key, (None, None))[1] is future:
+                del self._pending_reads[key]
+
+    async def _async_send_request(self, input_payload, priority):
+        retries = self.retries
+        probe = (self._check_circuit() == HYSEN_CIRCUIT_HALF_OPEN)
+        if probe:
+            retries = 0
+        try:
+            return_payload = await self._async_send_request_retry(input_payload, retries, priority)
+        except Exception as exc:
+            self._circuit_failure(exc)
+            self._invalidate_registers(input_payload)
+            raise
+        except BaseException:
+            # cancelled, the breaker mustn't stay half open waiting for this probe
+            if probe:
+                self.circuit.abort(time.monotonic())
+            self._invalidate_registers(input_payload)
+            raise
+        self._confirm_request(input_payload)
+        return return_payload
+
+    async def _async_send_request_retry(self, input_payload, retries, priority):
+        request_payload = self._pack_request(input_payload)
+        self.stats['requests'] += 1
+        attempt = 0
+        while True:
+            try:
+                response = await self.async_send_packet(
+                    0x6a, 
+                    request_payload, 
+                    self._rtt.timeout(attempt), 
+                    priority)
+                return self._unpack_response(input_payload, response)
+            except socket.timeout:
+                if attempt >= retries:
+                    self.stats['failures'] += 1
+                    raise
+                reason = HYSEN_HEAT_RETRY_TIMEOUT
+            except ValueError as exc:
+                reason = self._retry_reason(exc)
+                if (reason is None) or (attempt >= retries):
+                    self.stats['failures'] += 1
+                    raise
+            attempt += 1
+            self.stats['retries'] += 1
+            self.stats[reason] += 1
+            _LOGGER.debug("[%s] Retrying request, attempt %s, reason %s.", self._host, attempt, reason)
+            await asyncio.sleep(random.uniform(0, HYSEN_HEAT_RETRY_BACKOFF * (2 ** attempt)))
+
+    # Fails at once while the circuit breaker is open
+    # Returns the breaker decision, HYSEN_CIRCUIT_HALF_OPEN if the request probes the device
+    def _check_circuit(self):
+        now = time.monotonic()
+        decision = self.circuit.request(now)
+        if decision == HYSEN_CIRCUIT_OPEN:
+            raise ValueError('hysen_circuit_open', 
+                'device unreachable, next probe in %.0f s' % self.circuit.retry_after(now))
+        return decision
+
+    # A device which doesn't answer counts against the circuit breaker, 
+    # a device answering with an error is reachable
+    def _circuit_failure(self, exc):
+        if isinstance(exc, OSError):
+            self.circuit.failure(time.monotonic())
+        else:
+            self.circuit.success()
+
+    # Returns the stats reason of a retriable response error, None if the error is not retriable
+    def _retry_reason(self, exc):
+        if exc.args[0] == 'broadlink_response_error':
+            return HYSEN_HEAT_RETRY_BROADLINK
+        if (exc.args[0] == 'hysen_response_error') and \
+           (exc.args[1] in [HYSEN_HEAT_ERROR_LENGTH, HYSEN_HEAT_ERROR_CRC]):
+            return HYSEN_HEAT_RETRY_CRC
+        return None
+
+    # Returns a transaction, to be used as a context manager ("with" or "async with")
+    # The setters called inside the block are validated against the shadow register image, 
+    # refreshed once when the block is entered, and see each other's changes.
+    # Their writes are collected and committed when the block exits, adjacent words merged 
+    # in the fewest write requests. The words a setter writes are always sent, but for the 
+    # daily schedule, whose words left unchanged are not written at all.
+    # If the block raises, nothing is written.
+    # Its requests are sent in the given priority class.
+    def transaction(self, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
+        return HysenHeatingTransaction(self, priority)
+
+    # Sends only the words of a write request which differ from the shadow register image, 
+    # merged in the fewest contiguous write requests
+    def _send_delta_request(self, input_payload):
+        if self._transaction is not None:
+            self._transaction.add(input_payload, True)
+            return
+        with self.transaction() as transaction:
+            transaction.add(input_payload, True)
+
+    # Reads the device status only if the shadow register image is missing or stale:
+    # all the words if the cold ones are due, the hot ones if older than status_ttl
+    # Inside a transaction the image was refreshed when the transaction began
+    def _refresh_status(self):
+        if self._transaction is not None:
+            return
+        if self._cold_registers_stale():
+            self.get_device_status()
+        elif self._hot_registers_stale():
+            self.get_device_hot_status()
+
+    async def _async_refresh_status(self, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
+        if self._cold_registers_stale():
+            await self.async_get_device_status(priority)
+        elif self._hot_registers_stale():
+            await self.async_get_device_hot_status(priority)
+
+    def _hot_registers_stale(self):
+        return (self._hot_time is None) or \
+               ((time.monotonic() - self._hot_time) > self.status_ttl)
+
+    def _cold_registers_stale(self):
+        return (self._registers is None) or (self._cold_time is None) or \
+               ((time.monotonic() - self._cold_time) > self.cold_interval)
+
+    # A request the device answered: a write is applied to the shadow register image and 
+    # outdates the reads still in progress, which are dropped when they complete
+    def _confirm_request(self, input_payload):
+        self.circuit.success()
+        if self._request_words(input_payload) is not None:
+            self._write_generation += 1
+        self._update_registers(input_payload)
+        self._expire_cold_registers(input_payload)
+
+    # A confirmed write to the cold words has them read again on the next poll, 
+    # the setters keep trusting the shadow register image, which holds the write
+    def _expire_cold_registers(self, input_payload):
+        if self._writes_cold_words(input_payload):
+            self._cold_poll_due = True
+
+    def _writes_cold_words(self, input_payload):
+        words = self._request_words(input_payload)
+        return (words is not None) and ((words[0] + len(words[1]) // 2) > HYSEN_HEAT_HOT_WORDS)
+
+    # Returns the first word index and the data bytes of a write request, None for other requests
+    def _request_words(self, input_payload):
+        if input_payload[0:2] == bytearray([0x01, 0x06]):
+            return (input_payload[3], bytes(input_payload[4:6]))
+        elif input_payload[0:2] == bytearray([0x01, 0x10]):
+            return (input_payload[3], bytes(input_payload[7:]))
+        return None
+
+    # Applies the words of a write request to the shadow register image
+    # Inside a transaction the words aren't sent yet, the reads in progress are still valid
+    def _update_registers(self, input_payload):
+        words = self._request_words(input_payload)
+        if (self._registers is None) or (words is None):
+            return
+        start = 2 * words[0]
+        for i in range(len(words[1])):
+            mask = HYSEN_HEAT_REGISTERS_WRITE_MASK[start + i]
+            self._registers[start + i] = (self._registers[start + i] & ~mask & 0xFF) | (words[1][i] & mask)
+        self._decode_registers()
+
+    # The outcome of a failed write is unknown, the next setter has to read the device again
+    def _invalidate_registers(self, input_payload):
+        if input_payload[0:2] != bytearray([0x01, 0x03]):
+            self._hot_time = None
+            if self._writes_cold_words(input_payload):
+                self._cold_time = None
+
+    # Prepends length (2 bytes) and appends CRC to the request payload
+    def _pack_request(self, input_payload):
         for i in range(1, 3):
             crc = CRC16(modbus_flag = True).calculate(bytes(input_payload))
             if crc == None:
@@ -223,10 +828,10 @@ class HysenHeatingDevice(device):
         # append CRC
         request_payload.append(crc & 0xFF)
         request_payload.append((crc >> 8) & 0xFF)
+        return request_payload
 
-        # send to device
-        response = self.send_packet(0x6a, request_payload)
-
+    # Checks the broadlink error, decrypts the response and validates it against the request
+    def _unpack_response(self, input_payload, response):
         # check for error
         err = response[0x22] | (response[0x23] << 8)
         if err:
@@ -237,13 +842,13 @@ class HysenHeatingDevice(device):
         # check on CRC in response (first 2 bytes are len, and trailing bytes are crc)
         response_payload_len = response_payload[0]
         if response_payload_len + 2 > len(response_payload):
-            raise ValueError('hysen_response_error','first byte of response is not length')
+            raise ValueError('hysen_response_error', HYSEN_HEAT_ERROR_LENGTH)
         crc = CRC16(modbus_flag=True).calculate(bytes(response_payload[2:response_payload_len]))
         if (response_payload[response_payload_len] == crc & 0xFF) and \
            (response_payload[response_payload_len+1] == (crc >> 8) & 0xFF):
             return_payload = response_payload[2:response_payload_len]
         else:
-            raise ValueError('hysen_response_error','CRC check on response failed')
+            raise ValueError('hysen_response_error', HYSEN_HEAT_ERROR_CRC)
             
         # check if return response is right
         if (input_payload[0:2] == bytearray([0x01, 0x06])) and \
@@ -272,6 +877,169 @@ class HysenHeatingDevice(device):
         else:
             return return_payload
 
+    # Builds a broadlink packet the same way broadlink.device.send_packet does
+    # Layout: 0x38 bytes header followed by the AES encrypted payload
+    #   0x00-0x07 magic, 0x20-0x21 packet checksum, 0x24-0x25 device type of the sender,
+    #   0x26 command, 0x28-0x29 packet count, 0x2a-0x2f mac, 0x30-0x33 device id,
+    #   0x34-0x35 payload checksum
+    def _build_packet(self, command, payload):
+        self.count = (self.count + 1) & 0xFFFF
+        packet = bytearray(0x38)
+        packet[0x00:0x08] = bytearray([0x5a, 0xa5, 0xaa, 0x55, 0x5a, 0xa5, 0xaa, 0x55])
+        packet[0x24] = 0x2a
+        packet[0x25] = 0x27
+        packet[0x26] = command
+        packet[0x28] = self.count & 0xFF
+        packet[0x29] = self.count >> 8
+        packet[0x2a:0x30] = self.mac[0:6]
+        packet[0x30:0x34] = self.id[0:4]
+
+        # pad the payload for AES encryption
+        payload = bytes(payload)
+        if len(payload) > 0:
+            numpad = (len(payload) // 16 + 1) * 16
+            payload = payload.ljust(numpad, b"\x00")
+
+        checksum = 0xBEAF
+        for i in range(len(payload)):
+            checksum = (checksum + payload[i]) & 0xFFFF
+        packet[0x34] = checksum & 0xFF
+        packet[0x35] = checksum >> 8
+
+        packet.extend(self.encrypt(payload))
+
+        checksum = 0xBEAF
+        for i in range(len(packet)):
+            checksum = (checksum + packet[i]) & 0xFFFF
+        packet[0x20] = checksum & 0xFF
+        packet[0x21] = checksum >> 8
+        return packet
+
+    # Same as broadlink.device.send_packet, but a response whose packet count doesn't match 
+    # the request (a late reply to an earlier, timed out request) is discarded instead of 
+    # being taken as the answer to this request
+    def send_packet(self, command, payload):
+        packet = self._build_packet(command, payload)
+        count = self.count
+        start_time = time.time()
+        with self.lock:
+            if self.cs is None:
+                self._open_socket()
+            self.cs.sendto(packet, self.host)
+            while True:
+                try:
+                    self.cs.settimeout(1)
+                    response = bytearray(self.cs.recvfrom(2048)[0])
+                except socket.timeout:
+                    if (time.time() - start_time) > self.timeout:
+                        raise
+                    self.cs.sendto(packet, self.host)
+                    continue
+                if (len(response) >= 0x38) and \
+                   ((response[0x28] | (response[0x29] << 8)) == count):
+                    return response
+                _LOGGER.debug("[%s] Discarding stale response.", self._host)
+
+    # Opens the blocking UDP socket the same way broadlink.device.__init__ does
+    def _open_socket(self):
+        self.cs = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.cs.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.cs.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.cs.bind(('', 0))
+
+    def _close_socket(self):
+        if self.cs is not None:
+            self.cs.close()
+            self.cs = None
+
+    # Sends a broadlink packet through the asyncio datagram transport
+    # Up to window requests are in flight to the device at the same time, admitted by priority, 
+    # responses are matched to their request by packet count
+    # Returns the raw response packet, the round trip time feeds the RTT estimator
+    # Raises socket.timeout if the device doesn't answer within timeout (default device timeout)
+    async def async_send_packet(self, command, payload, timeout = None, priority = HYSEN_HEAT_PRIORITY_INTERACTIVE):
+        if timeout is None:
+            timeout = self.timeout
+        if self._transport is None:
+            self._transport = HysenHeatingTransport()
+            self._own_transport = True
+        await self._queue.acquire(priority)
+        try:
+            packet = self._build_packet(command, payload)
+            start_time = time.monotonic()
+            response = await self._transport.async_send_packet(
+                self.host, 
+                self.mac[0:6], 
+                self.count, 
+                packet, 
+                timeout)
+            self._rtt.sample(time.monotonic() - start_time)
+            return response
+        finally:
+            self._queue.release()
+
+    # Asyncio counterpart of broadlink.device.auth
+    # The handshake goes through the datagram transport, so many devices can be authenticated at once
+    # The response carries the device id and the session AES key used by all later requests
+    # The handshake itself is sent with the initial id and key, whatever session was cached 
+    # or negotiated before, since the device may have just rejected it
+    # Returns True if the device accepted the handshake
+    async def async_auth(self):
+        self.authenticated = False
+        self.id = bytearray(HYSEN_HEAT_AUTH_ID)
+        self._set_key(HYSEN_HEAT_AUTH_KEY)
+        payload = bytearray(0x50)
+        payload[0x04:0x13] = bytearray([0x31] * 15)
+        payload[0x1e] = 0x01
+        payload[0x2d] = 0x01
+        payload[0x30:0x37] = bytearray(b'Test  1')
+        response = await self.async_send_packet(0x65, payload)
+        if response[0x22] | (response[0x23] << 8):
+            return False
+        response_payload = self.decrypt(bytes(response[0x38:]))
+        if not response_payload:
+            return False
+        key = response_payload[0x04:0x14]
+        if len(key) % 16 != 0:
+            return False
+        self.restore_session(response_payload[0x00:0x04], key)
+        return True
+
+    # Device id and AES key of the current session, as bytes, to be cached across restarts
+    @property
+    def session(self):
+        return (bytes(self.id), bytes(self.key))
+
+    # Reuses a session negotiated earlier, no handshake with the device
+    def restore_session(self, device_id, key):
+        self.id = bytearray(device_id)
+        self._set_key(key)
+        self.authenticated = True
+
+    # broadlink 0.9.0 encrypts with self.key as is, later versions keep a cipher made by update_aes
+    def _set_key(self, key):
+        self.key = bytearray(key)
+        if hasattr(self, 'update_aes'):
+            self.update_aes(bytes(key))
+
+    # Tells whether a request failed, after all its retries, because the device doesn't accept 
+    # the session key: a broadlink error, or a response which doesn't decrypt to a valid frame
+    # (e.g. the device was power cycled and expects a new handshake). The session is then dropped.
+    def session_rejected(self, exc):
+        if isinstance(exc, ValueError) and (self._retry_reason(exc) is not None):
+            self.authenticated = False
+            return True
+        return False
+
+    # Closes the blocking socket, and the asyncio datagram transport unless it is shared with other devices
+    def close(self):
+        with self.lock:
+            self._close_socket()
+        if self._own_transport:
+            self._transport.close()
+            self._transport = None
+            self._own_transport = False
+
     # set lock and power
     # 0x01, 0x06, 0x00, 0x00, 0x0r, 0xap
     # r = Remote lock, 0 = Off, 1 = On
@@ -280,10 +1048,10 @@ class HysenHeatingDevice(device):
     # confirmation response:
     # response 0x01, 0x06, 0x00, 0x00, 0x0r, 0x0p
     def set_lock_power(self, remote_lock, power_state):
-        _request = bytearray([0x01, 0x06, 0x00, 0x00])
-        _request.append(remote_lock)
-        _request.append(power_state)
-        self.send_request(_request)
+        self.send_request(hysen_heat_write_request(
+            0x00, 1, 
+            remote_lock = remote_lock, 
+            power_state = power_state))
 
     def set_remote_lock(self, remote_lock):
         if remote_lock not in [
@@ -294,7 +1062,7 @@ class HysenHeatingDevice(device):
                 remote_lock,
                 HYSEN_HEAT_REMOTE_LOCK_OFF,
                 HYSEN_HEAT_REMOTE_LOCK_ON))
-        self.get_device_status()
+        self._refresh_status()
         self.set_lock_power(
             remote_lock, 
             self.power_state)
@@ -308,7 +1076,7 @@ class HysenHeatingDevice(device):
                 power_state,
                 HYSEN_HEAT_POWER_OFF,
                 HYSEN_HEAT_POWER_ON))
-        self.get_device_status()
+        self._refresh_status()
         self.set_lock_power(
             self.remote_lock, 
             power_state | (self.power_state & 0xFE))
@@ -320,7 +1088,7 @@ class HysenHeatingDevice(device):
     # response 0x01,0x06,0x00,0x01,0x00,Tt
     # Note: If in automatic mode, setting temperature changes to manual mode
     def set_target_temp(self, temp):
-        self.get_device_status()
+        self._refresh_status()
         if temp > self.max_temp:
             raise ValueError(
                 'Can\'t set a target temperature (%s°) higher than maximum set (%s°).' % ( \
@@ -335,10 +1103,9 @@ class HysenHeatingDevice(device):
         # we'll need it to restore it at a later time, in case of manual over auto, then auto, then manual
         if (self.operation_mode == HYSEN_HEAT_MODE_MANUAL):
             self.manual_target_temp = temp
-        _request = bytearray([0x01, 0x06, 0x00, 0x01])
-        _request.append(0)
-        _request.append(int(temp * 2))
-        self.send_request(_request)
+        self.send_request(hysen_heat_write_request(
+            0x01, 1, 
+            target_temp = temp))
 
     # set mode, loop and sensor type
     # 0x01, 0x06, 0x00, 0x02, 0xlm, Sen
@@ -349,10 +1116,11 @@ class HysenHeatingDevice(device):
     # response 0x01, 0x06, 0x00, 0x02, 0xml, Sen
     # Note:  
     def set_mode_loop_sensor(self, operation_mode, schedule, sensor):
-        _request = bytearray([0x01, 0x06, 0x00, 0x02])
-        _request.append((schedule<<4) + operation_mode)
-        _request.append(sensor)
-        self.send_request(_request)
+        self.send_request(hysen_heat_write_request(
+            0x02, 1, 
+            operation_mode = operation_mode, 
+            schedule = schedule, 
+            sensor = sensor))
 
     def set_sensor(self, sensor):
         if sensor not in [
@@ -365,7 +1133,7 @@ class HysenHeatingDevice(device):
                 HYSEN_HEAT_SENSOR_INTERNAL,
                 HYSEN_HEAT_SENSOR_EXTERNAL, 
                 HYSEN_HEAT_SENSOR_INT_EXT))
-        self.get_device_status()
+        self._refresh_status()
         self.set_mode_loop_sensor(
             self.operation_mode, 
             self.schedule, 
@@ -380,7 +1148,7 @@ class HysenHeatingDevice(device):
                 operation_mode,
                 HYSEN_HEAT_MODE_MANUAL,
                 HYSEN_HEAT_MODE_AUTO))
-        self.get_device_status()
+        self._refresh_status()
         self.set_mode_loop_sensor(
             operation_mode, 
             self.schedule, 
@@ -397,7 +1165,7 @@ class HysenHeatingDevice(device):
                 HYSEN_HEAT_SCHEDULE_12345_67,
                 HYSEN_HEAT_SCHEDULE_123456_7, 
                 HYSEN_HEAT_SCHEDULE_1234567))
-        self.get_device_status()
+        self._refresh_status()
         self.set_mode_loop_sensor(
             self.operation_mode, 
             schedule, 
@@ -416,21 +1184,15 @@ class HysenHeatingDevice(device):
     # confirmation response:
     # payload 0x01,0x10,0x00,0x03,0x00,0x08
     def set_options(self, external_limit_temp, hysteresis, max_temp, min_temp, calibration, frost_protection, poweron):
-        calibration = int(calibration * 2)
-        # Convert to signed byte
-        calibration = (0x10000 + calibration) & 0xFFFF
-        calibration_MSB = (calibration >> 8) & 0xFF
-        calibration_LSB = calibration & 0xFF
-        _request = bytearray([0x01, 0x10, 0x00, 0x03, 0x00, 0x04, 0x08])
-        _request.append(int(external_limit_temp))
-        _request.append(int(hysteresis))
-        _request.append(max_temp)
-        _request.append(min_temp)
-        _request.append(calibration_MSB)
-        _request.append(calibration_LSB)
-        _request.append(frost_protection)
-        _request.append(poweron)
-        self.send_request(_request)
+        self.send_request(hysen_heat_write_request(
+            0x03, 4, 
+            external_limit_temp = external_limit_temp, 
+            hysteresis = hysteresis, 
+            max_temp = max_temp, 
+            min_temp = min_temp, 
+            calibration = calibration, 
+            frost_protection = frost_protection, 
+            poweron = poweron))
 
     def set_external_limit_temp(self, external_limit_temp):
         if external_limit_temp < HYSEN_HEAT_MIN_TEMP:
@@ -443,7 +1205,7 @@ class HysenHeatingDevice(device):
                 'Can\'t set external limit temperature (%s°) higher than device\'s maximum (%s°).' % ( \
                 external_limit_temp,
                 HYSEN_HEAT_MAX_TEMP))
-        self.get_device_status()
+        self._refresh_status()
         self.set_options(
             external_limit_temp,
             self.hysteresis, 
@@ -464,7 +1226,7 @@ class HysenHeatingDevice(device):
                 'Can\'t set hysteresis (%s°) higher than device\'s maximum (%s°).' % ( \
                 hysteresis,
                 HYSEN_HEAT_HYSTERESIS_MAX))
-        self.get_device_status()
+        self._refresh_status()
         self.set_options(
             self.external_limit_temp,
             hysteresis, 
@@ -475,7 +1237,7 @@ class HysenHeatingDevice(device):
             self.poweron)
 
     def set_max_temp(self, temp):
-        self.get_device_status()
+        self._refresh_status()
         if temp > HYSEN_HEAT_MAX_TEMP:
             raise ValueError(
                 'Can\'t set maximum temperature (%s°) higher than device\'s maximum (%s°).' % ( \
@@ -501,7 +1263,7 @@ class HysenHeatingDevice(device):
             self.poweron)
 
     def set_min_temp(self, temp):
-        self.get_device_status()
+        self._refresh_status()
         if temp < HYSEN_HEAT_MIN_TEMP:
             raise ValueError(
                 'Can\'t set minimum temperature (%s°) lower than device\'s minimum (%s°).' % ( \
@@ -537,7 +1299,7 @@ class HysenHeatingDevice(device):
                 'Can\'t set calibration (%s°) higher than device\'s maximum (%s°).' % ( \
                 calibration,
                 HYSEN_HEAT_CALIBRATION_MAX))
-        self.get_device_status()
+        self._refresh_status()
         self.set_options(
             self.external_limit_temp,
             self.hysteresis, 
@@ -556,7 +1318,7 @@ class HysenHeatingDevice(device):
                 frost_protection,
                 HYSEN_HEAT_FROST_PROTECTION_OFF,
                 HYSEN_HEAT_FROST_PROTECTION_ON))
-        self.get_device_status()
+        self._refresh_status()
         self.set_options(
             self.external_limit_temp,
             self.hysteresis, 
@@ -575,7 +1337,7 @@ class HysenHeatingDevice(device):
                 poweron,
                 HYSEN_HEAT_POWERON_OFF,
                 HYSEN_HEAT_POWERON_ON))
-        self.get_device_status()
+        self._refresh_status()
         self.set_options(
             self.external_limit_temp,
             self.hysteresis, 
@@ -610,12 +1372,12 @@ class HysenHeatingDevice(device):
             raise ValueError(
                 'Second (%s) has to be between 0 and 59.' % ( \
                 clock_second))
-        _request = bytearray([0x01, 0x10, 0x00, 0x08, 0x00, 0x02, 0x04])
-        _request.append(clock_hour)
-        _request.append(clock_minute)
-        _request.append(clock_second)
-        _request.append(clock_weekday)
-        self.send_request(_request)
+        self.send_request(hysen_heat_write_request(
+            0x08, 2, 
+            clock_hour = clock_hour, 
+            clock_min = clock_minute, 
+            clock_sec = clock_second, 
+            clock_weekday = clock_weekday))
 
     # set daily schedule
     # 0x01, 0x10, 0x00, 0x0A, 0x00, 0x0C, 0x18, P1h, P1m, P1t, P2h, P2m, P2t, P3h, P3m, P3t, 
@@ -640,36 +1402,38 @@ class HysenHeatingDevice(device):
     # P6t = Period1 temperature
     # confirmation response:
     # payload 0x01, 0x10, 0x00, 0x0A, 0x00, 0x0C
+    # Only the words which differ from the shadow register image are sent,
+    # e.g. changing period3 temperature sends 0x01, 0x06, 0x00, 0x13, P3t, P4t
     def set_daily_schedule(self, period1_hour, period1_min, period2_hour, period2_min, period3_hour, period3_min, period4_hour, period4_min, period5_hour, period5_min, period6_hour, period6_min, we_period1_hour, we_period1_min, we_period6_hour, we_period6_min, period1_temp, period2_temp, period3_temp, period4_temp, period5_temp, period6_temp, we_period1_temp, we_period6_temp):
-        _request = bytearray([0x01, 0x10, 0x00, 0x0A, 0x00, 0x0C, 0x18])
-        _request.append(period1_hour)
-        _request.append(period1_min)
-        _request.append(period2_hour)
-        _request.append(period2_min)
-        _request.append(period3_hour)
-        _request.append(period3_min)
-        _request.append(period4_hour)
-        _request.append(period4_min)
-        _request.append(period5_hour)
-        _request.append(period5_min)
-        _request.append(period6_hour)
-        _request.append(period6_min)
-        _request.append(we_period1_hour)
-        _request.append(we_period1_min)
-        _request.append(we_period6_hour)
-        _request.append(we_period6_min)
-        _request.append(int(period1_temp * 2))
-        _request.append(int(period2_temp * 2))
-        _request.append(int(period3_temp * 2))
-        _request.append(int(period4_temp * 2))
-        _request.append(int(period5_temp * 2))
-        _request.append(int(period6_temp * 2))
-        _request.append(int(we_period1_temp * 2))
-        _request.append(int(we_period6_temp * 2))
-        self.send_request(_request)
+        self._send_delta_request(hysen_heat_write_request(
+            0x0A, 12, 
+            period1_hour = period1_hour,
+            period1_min = period1_min,
+            period2_hour = period2_hour,
+            period2_min = period2_min,
+            period3_hour = period3_hour,
+            period3_min = period3_min,
+            period4_hour = period4_hour,
+            period4_min = period4_min,
+            period5_hour = period5_hour,
+            period5_min = period5_min,
+            period6_hour = period6_hour,
+            period6_min = period6_min,
+            we_period1_hour = we_period1_hour,
+            we_period1_min = we_period1_min,
+            we_period6_hour = we_period6_hour,
+            we_period6_min = we_period6_min,
+            period1_temp = period1_temp,
+            period2_temp = period2_temp,
+            period3_temp = period3_temp,
+            period4_temp = period4_temp,
+            period5_temp = period5_temp,
+            period6_temp = period6_temp,
+            we_period1_temp = we_period1_temp,
+            we_period6_temp = we_period6_temp))
 
     def set_period1(self, period1_hour = None, period1_min = None, period1_temp = None):
-        self.get_device_status()
+        self._refresh_status()
         if (period1_hour == None):
             period1_hour = self.period1_hour
         if (period1_min == None):
@@ -729,7 +1493,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_period2(self, period2_hour, period2_min, period2_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (period2_hour == None):
             period2_hour = self.period2_hour
         if (period2_min == None):
@@ -797,7 +1561,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_period3(self, period3_hour, period3_min, period3_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (period3_hour == None):
             period3_hour = self.period3_hour
         if (period3_min == None):
@@ -865,7 +1629,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_period4(self, period4_hour, period4_min, period4_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (period4_hour == None):
             period4_hour = self.period4_hour
         if (period4_min == None):
@@ -933,7 +1697,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_period5(self, period5_hour, period5_min, period5_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (period5_hour == None):
             period5_hour = self.period5_hour
         if (period5_min == None):
@@ -1001,7 +1765,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_period6(self, period6_hour, period6_min, period6_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (period6_hour == None):
             period6_hour = self.period6_hour
         if (period6_min == None):
@@ -1061,7 +1825,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_we_period1(self, we_period1_hour, we_period1_min, we_period1_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (we_period1_hour == None):
             we_period1_hour = self.we_period1_hour
         if (we_period1_min == None):
@@ -1121,7 +1885,7 @@ class HysenHeatingDevice(device):
             self.we_period6_temp)
 
     def set_we_period6(self, we_period6_hour, we_period6_min, we_period6_temp):
-        self.get_device_status()
+        self._refresh_status()
         if (we_period6_hour == None):
             we_period6_hour = self.we_period6_hour
         if (we_period6_min == None):
@@ -1236,59 +2000,139 @@ class HysenHeatingDevice(device):
     # Unk2 = Unknown, 0x01
     # Unk3 = Unknown, 0x02
     def get_device_status(self):
-        _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, 0x17])
+        _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, HYSEN_HEAT_STATUS_WORDS])
+        _response = self.send_request(_request)
+        self._update_status(_response)
+
+    # A read overtaken by a confirmed write may carry data older than the write, 
+    # it is dropped and the shadow register image keeps the write
+    # Returns True if the words read were applied, False if the read was dropped
+    async def async_get_device_status(self, priority = HYSEN_HEAT_PRIORITY_POLL):
+        _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, HYSEN_HEAT_STATUS_WORDS])
+        _generation = self._write_generation
+        _response = await self.async_send_request(_request, priority)
+        return self._update_status_since(_generation, _response)
+
+    # get device hot status
+    # 0x01, 0x03, 0x00, 0x00, 0x00, 0x08
+    # response:
+    # 0x01, 0x03, 0x10, 0x0r, 0xavp, Rt, Tt, 0xlm, Sen, Osv, Dif, Svh, Svl, AdjMSB, AdjLSB, Fre, POn, Unk1, Ext
+    # The words read are merged in the shadow register image, the cold ones are kept from the last full read
+    # A full read is done instead if there is no shadow register image yet
+    def get_device_hot_status(self):
+        if self._registers is None:
+            self.get_device_status()
+            return
+        _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, HYSEN_HEAT_HOT_WORDS])
         _response = self.send_request(_request)
+        self._update_status(_response)
+
+    async def async_get_device_hot_status(self, priority = HYSEN_HEAT_PRIORITY_POLL):
+        if self._registers is None:
+            await self.async_get_device_status(priority)
+            return
+        _request = bytearray([0x01, 0x03, 0x00, 0x00, 0x00, HYSEN_HEAT_HOT_WORDS])
+        _generation = self._write_generation
+        _response = await self.async_send_request(_request, priority)
+        self._update_status_since(_generation, _response)
+
+    # Tiered poll: reads all the words when the cold ones are due, only the hot ones otherwise
+    # Returns True if all the words were read, and applied (a full read overtaken by a write 
+    # is dropped, the cold words stay due)
+    def poll_status(self):
+        if self._cold_poll_due or self._cold_registers_stale():
+            self.get_device_status()
+            return True
+        self.get_device_hot_status()
+        return False
+
+    async def async_poll_status(self, priority = HYSEN_HEAT_PRIORITY_POLL):
+        if self._cold_poll_due or self._cold_registers_stale():
+            return await self.async_get_device_status(priority)
+        await self.async_get_device_hot_status(priority)
+        return False
+
+    # Queue depth metrics of the transactions and of the requests of the device: 
+    # waiting now, the most seen waiting, and the total which had to wait
+    @property
+    def queue_depth(self):
+        return {
+            'transactions': self._serial.depth,
+            'transactions_max': self._serial.max_depth,
+            'transactions_waited': self._serial.waited,
+            'requests': self._queue.depth,
+            'requests_max': self._queue.max_depth,
+            'requests_waited': self._queue.waited,
+        }
+
+    # Returns False if the read is dropped
+    def _update_status_since(self, _generation, _response):
+        if (_generation != self._write_generation) and (self._registers is not None):
+            self.stats['stale_reads'] += 1
+            _LOGGER.debug("[%s] Dropping a status read overtaken by a write.", self._host)
+            return False
+        self._update_status(_response)
+        return True
+
+    def _update_status(self, _response):
 #        _LOGGER.debug("[%s] get_device_status : %s", 
 #            self._host, 
 #            ' '.join(format(x, '02x') for x in bytearray(_response)))
-        self.remote_lock = _response[3] & 0x01
-        self.manual_over_auto = (_response[4] >> 6) & 0x01
-        self.valve_state =  (_response[4] >> 4) & 0x01
-        self.power_state =  _response[4] & 0x01
-        self.room_temp = float((_response[5] & 0xFF) / 2.0)
-        self.target_temp = float((_response[6] & 0xFF) / 2.0)
-        self.operation_mode = _response[7] & 0x0F
-        self.schedule = (_response[7] >> 4) & 0x0F
-        self.sensor = _response[8]
-        self.external_limit_temp = float(_response[9])
-        self.hysteresis = _response[10]
-        self.max_temp = _response[11]
-        self.min_temp = _response[12]
-        self.calibration = (_response[13] << 8) + _response[14]
-        if self.calibration > 0x7FFF:
-            self.calibration = self.calibration - 0x10000
-        self.calibration = float(self.calibration / 2.0)
-        self.frost_protection = _response[15]
-        self.poweron = _response[16]
-        self.unknown1 = _response[17]
-        self.external_temp = float((_response[18] & 0xFF) / 2.0)
-        self.clock_hour = _response[19]
-        self.clock_min = _response[20]
-        self.clock_sec = _response[21]
-        self.clock_weekday = _response[22]
-        self.period1_hour = _response[23]
-        self.period1_min = _response[24]
-        self.period2_hour = _response[25]
-        self.period2_min = _response[26]
-        self.period3_hour = _response[27]
-        self.period3_min = _response[28]
-        self.period4_hour = _response[29]
-        self.period4_min = _response[30]
-        self.period5_hour = _response[31]
-        self.period5_min = _response[32]
-        self.period6_hour = _response[33]
-        self.period6_min = _response[34]
-        self.we_period1_hour = _response[35]
-        self.we_period1_min = _response[36]
-        self.we_period6_hour = _response[37]
-        self.we_period6_min = _response[38]
-        self.period1_temp = float(_response[39] / 2.0)
-        self.period2_temp = float(_response[40] / 2.0)
-        self.period3_temp = float(_response[41] / 2.0)
-        self.period4_temp = float(_response[42] / 2.0)
-        self.period5_temp = float(_response[43] / 2.0)
-        self.period6_temp = float(_response[44] / 2.0)
-        self.we_period1_temp = float(_response[45] / 2.0)
-        self.we_period6_temp = float(_response[46] / 2.0)
-        self.unknown2 = _response[47]
-        self.unknown3 = _response[48]
+        _now = time.monotonic()
+        if len(_response) - 3 == 2 * HYSEN_HEAT_STATUS_WORDS:
+            self._registers = bytearray(_response[3:])
+            self._cold_time = _now
+            self._cold_poll_due = False
+        else:
+            self._registers[0:len(_response) - 3] = _response[3:]
+        self._hot_time = _now
+        self._decode_registers()
+
+    # Publishes the shadow register image as the device status snapshot
+    # A new snapshot is only made when the image changed
+    def _decode_registers(self):
+        if self._registers != self.status.registers:
+            self.status = HysenHeatingStatus(self._registers)
+
+# register fields of the latest snapshot, e.g. device.room_temp is device.status.room_temp
+for _name in HYSEN_HEAT_FIELD_NAMES:
+    setattr(HysenHeatingDevice, _name, property(operator.attrgetter('status.' + _name)))
+
+# Finds the Hysen heating thermostats of one or more subnets in a single pass:
+# a broadlink hello is broadcast to each of discover_ip_addresses (e.g. 192.168.1.255), 
+# the devices answering with another device type are ignored
+# The thermostats found are authenticated concurrently, at most parallel handshakes at a time, 
+# through transport (shared by the fleet)
+# restore(device), if given, restores a cached session of the device and returns True, 
+# the device then skips the handshake
+# Returns the authenticated HysenHeatingDevice instances, a device failing its handshake is left out
+async def hysen_heat_async_discover(
+        transport, 
+        discover_ip_addresses, 
+        timeout, 
+        discovery_timeout = HYSEN_HEAT_DEFAULT_DISCOVERY_TIMEOUT, 
+        parallel = HYSEN_HEAT_DEFAULT_DISCOVERY_PARALLEL, 
+        local_ip_address = None, 
+        restore = None):
+    found = await HysenHeatingDiscovery().async_discover(
+        discover_ip_addresses, 
+        discovery_timeout, 
+        local_ip_address)
+    devices = [HysenHeatingDevice(host, mac, devtype, timeout, transport)
+               for host, mac, devtype in found if devtype == HYSEN_HEAT_DEVTYPE]
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def async_auth(hysen_device):
+        if (restore is not None) and restore(hysen_device):
+            return hysen_device
+        async with semaphore:
+            try:
+                if await hysen_device.async_auth():
+                    return hysen_device
+                _LOGGER.error("[%s] Device not authenticated.", hysen_device._host)
+            except Exception as exc:
+                _LOGGER.error("[%s] Device authentication error: %s", hysen_device._host, exc)
+        return None
+
+    results = await asyncio.gather(*[async_auth(hysen_device) for hysen_device in devices])
+    return [hysen_device for hysen_device in results if hysen_device is not None]
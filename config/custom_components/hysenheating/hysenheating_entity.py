@@ -0,0 +1,79 @@
+"""
+Hysen Heating Thermostat Controller entities fed by the climate entity
+Hysen HY03-1-Wifi device and derivative
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import logging
+
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import Entity
+
+_LOGGER = logging.getLogger(__name__)
+
+# Sent with the host of the thermostat each time its climate entity publishes a new state
+SIGNAL_HYSEN_HEATING_UPDATED = 'hysenheating_updated_{}'
+
+class HysenHeatingEntity(Entity):
+    """Entity fed from the status of a Hysen Heating thermostat.
+
+    The climate entity does the polling. The entity follows its updates and
+    writes a new state only when its own value changed. Its value is read from
+    a status snapshot by the given getter.
+    """
+
+    def __init__(self, name, heating, value):
+        """Initialize the entity."""
+        self._name = name
+        self._heating = heating
+        self._status_value = value
+
+        self._available = False
+        self._value = None
+        self._unsub_update = None
+
+    @property
+    def should_poll(self):
+        """Return the polling state. The climate entity polls the device."""
+        return False
+
+    @property
+    def name(self):
+        """Returns the name of the entity."""
+        return self._name
+
+    @property
+    def available(self):
+        """Return True if the thermostat is available."""
+        return self._available
+
+    async def async_added_to_hass(self):
+        """Follow the updates of the climate entity."""
+        self._unsub_update = async_dispatcher_connect(
+            self.hass,
+            SIGNAL_HYSEN_HEATING_UPDATED.format(self._heating.host),
+            self._async_heating_updated)
+        self._read_status(self._heating.hysen_device.status)
+
+    async def async_will_remove_from_hass(self):
+        """Stop following the climate entity."""
+        if self._unsub_update is not None:
+            self._unsub_update()
+            self._unsub_update = None
+
+    def _read_status(self, status):
+        """Read the value from a status snapshot. Returns True if it changed."""
+        available = self._heating.available
+        value = self._status_value(status)
+        if (available == self._available) and (value == self._value):
+            return False
+        self._available = available
+        self._value = value
+        return True
+
+    @callback
+    def _async_heating_updated(self):
+        """Write the state if the climate entity published a different value."""
+        if self._read_status(self._heating.hysen_device.status):
+            self.async_schedule_update_ha_state()
@@ -0,0 +1,342 @@
+"""
+Hysen Heating Thermostat Controller asyncio transport
+Hysen HY03-1-Wifi device and derivative
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import random
+import socket
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+class HysenHeatingTransport(asyncio.DatagramProtocol):
+    """Single UDP endpoint shared by a whole thermostat fleet.
+
+    Requests from every device go out through the same socket. Responses are
+    routed back to the waiting caller by source address, MAC and packet count.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self._open_lock = None
+        self._requests = {}
+        self.discarded = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        for future in self._requests.values():
+            if not future.done():
+                future.set_exception(exc or ConnectionError('transport closed'))
+
+    # Broadlink response header
+    #   0x28-0x29 packet count, echoed from the request
+    #   0x2a-0x2f mac, echoed from the request
+    def datagram_received(self, data, addr):
+        if len(data) < 0x38:
+            _LOGGER.debug("Discarding short datagram from %s", addr)
+            return
+        key = (addr[0], bytes(data[0x2a:0x30]), data[0x28] | (data[0x29] << 8))
+        future = self._requests.get(key)
+        if (future is None) or future.done():
+            # most likely a late reply to a request that already timed out
+            self.discarded += 1
+            _LOGGER.debug("Discarding stale datagram from %s, packet count %s", addr, key[2])
+            return
+        future.set_result(bytearray(data))
+
+    def error_received(self, exc):
+        # The socket is not connected, errors can't be matched to a request.
+        # The affected request times out.
+        _LOGGER.debug("Transport error: %s", exc)
+
+    async def _async_open(self):
+        if self._open_lock is None:
+            self._open_lock = asyncio.Lock()
+        async with self._open_lock:
+            if self.transport is None:
+                await asyncio.get_event_loop().create_datagram_endpoint(
+                    lambda: self,
+                    local_addr = ('0.0.0.0', 0))
+
+    # Sends a packet to host and waits for the response carrying the same mac and count
+    # Raises socket.timeout if no response is received within timeout seconds
+    async def async_send_packet(self, host, mac, count, packet, timeout):
+        await self._async_open()
+        key = (host[0], bytes(mac), count)
+        if key in self._requests:
+            raise ValueError('hysen_transport_error', 'request already in flight')
+        future = asyncio.get_event_loop().create_future()
+        self._requests[key] = future
+        try:
+            self.transport.sendto(packet, host)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout('timed out')
+        finally:
+            del self._requests[key]
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+# request priority classes, most urgent first
+HYSEN_PRIORITY_INTERACTIVE = 0
+HYSEN_PRIORITY_VERIFY      = 1
+HYSEN_PRIORITY_POLL        = 2
+HYSEN_PRIORITY_MAINTENANCE = 3
+
+class HysenHeatingRequestQueue(object):
+    """Admission of the requests of one device to its window of requests in flight.
+
+    A free slot goes to the most urgent waiting request, in arrival order within 
+    a priority class. Each attempt of a request is admitted on its own, so a 
+    command overtakes the retries of a background read. Requests below the 
+    interactive class never take the last free slot, which stays available for 
+    a command.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        # queue depth metrics: the most requests seen waiting, and the requests which had to wait
+        self.max_depth = 0
+        self.waited = 0
+
+    @property
+    def depth(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority):
+        if (not self._waiters) and self._can_enter(priority):
+            self.in_flight += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.waited += 1
+        self.max_depth = max(self.max_depth, len(self._waiters))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was given just as the request was cancelled
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _can_enter(self, priority):
+        if priority == HYSEN_PRIORITY_INTERACTIVE:
+            return self.in_flight < self.window
+        return self.in_flight < max(self.window - 1, 1)
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_enter(priority):
+                break
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            future.set_result(None)
+
+class HysenHeatingRtt(object):
+    """Smoothed round trip time estimator of one device (RFC 6298).
+
+    Drives the timeout of each attempt: a short one while the device answers 
+    quickly, doubled on each retry, never above max_timeout.
+    """
+
+    def __init__(self, min_timeout, max_timeout, initial_timeout):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.rto = min(max(initial_timeout, min_timeout), max_timeout)
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.min_timeout), self.max_timeout)
+
+    def timeout(self, attempt):
+        return min(self.rto * (2 ** attempt), self.max_timeout)
+
+class HysenHeatingDiscovery(asyncio.DatagramProtocol):
+    """Broadcast broadlink discovery.
+
+    A single hello packet is broadcast to each given address (one per subnet)
+    from one socket, and every answer received within the timeout is collected.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.found = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    # Broadlink hello response
+    #   0x34-0x35 device type, 0x3a-0x3f mac
+    def datagram_received(self, data, addr):
+        if len(data) < 0x40:
+            return
+        devtype = data[0x34] | (data[0x35] << 8)
+        mac = bytes(data[0x3a:0x40])
+        self.found[mac] = (addr, mac, devtype)
+
+    def error_received(self, exc):
+        _LOGGER.debug("Discovery error: %s", exc)
+
+    # Broadlink hello packet, the same broadlink.discover sends
+    #   0x08-0x0b timezone, 0x0c-0x13 local date and time, 0x18-0x1b ip address and 
+    #   0x1c-0x1d port to answer to, 0x20-0x21 checksum, 0x26 command (6 = hello)
+    def _hello_packet(self, local_ip_address, port):
+        now = datetime.datetime.now()
+        timezone = int(time.timezone / -3600)
+        packet = bytearray(0x30)
+        if timezone < 0:
+            packet[0x08] = 0xff + timezone - 1
+            packet[0x09:0x0c] = bytearray([0xff, 0xff, 0xff])
+        else:
+            packet[0x08] = timezone
+        packet[0x0c] = now.year & 0xff
+        packet[0x0d] = now.year >> 8
+        packet[0x0e] = now.minute
+        packet[0x0f] = now.hour
+        packet[0x10] = now.year % 100
+        packet[0x11] = now.isoweekday()
+        packet[0x12] = now.day
+        packet[0x13] = now.month
+        packet[0x18:0x1c] = bytearray(int(x) for x in local_ip_address.split('.'))
+        packet[0x1c] = port & 0xff
+        packet[0x1d] = port >> 8
+        packet[0x26] = 6
+        checksum = 0xBEAF
+        for i in range(len(packet)):
+            checksum = (checksum + packet[i]) & 0xFFFF
+        packet[0x20] = checksum & 0xFF
+        packet[0x21] = checksum >> 8
+        return packet
+
+    # Broadcasts a hello to each of discover_ip_addresses and waits timeout seconds for the answers
+    # Returns a list of (host, mac, devtype), one per device however many subnets it answered on
+    async def async_discover(self, discover_ip_addresses, timeout, local_ip_address = None):
+        if local_ip_address is None:
+            local_ip_address = _local_ip_address()
+        await asyncio.get_event_loop().create_datagram_endpoint(
+            lambda: self,
+            local_addr = (local_ip_address, 0),
+            allow_broadcast = True)
+        try:
+            packet = self._hello_packet(
+                local_ip_address, 
+                self.transport.get_extra_info('sockname')[1])
+            for discover_ip_address in discover_ip_addresses:
+                self.transport.sendto(packet, (discover_ip_address, 80))
+            await asyncio.sleep(timeout)
+        finally:
+            self.transport.close()
+        return list(self.found.values())
+
+# Address of the interface the default route goes through, as broadlink.discover finds it
+# Connecting a datagram socket sends nothing
+def _local_ip_address():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('8.8.8.8', 53))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+HYSEN_CIRCUIT_CLOSED    = 'closed'
+HYSEN_CIRCUIT_OPEN      = 'open'
+HYSEN_CIRCUIT_HALF_OPEN = 'half_open'
+
+class HysenHeatingCircuitBreaker(object):
+    """Circuit breaker of one device.
+
+    Closed: requests go through, consecutive failures are counted.
+    Open: after failures consecutive failures, requests fail at once for 
+    open_time seconds.
+    Half open: once open_time is over, a single request probes the device. 
+    Success closes the breaker, failure opens it again for twice as long, 
+    never more than max_open_time.
+    """
+
+    def __init__(self, failures, open_time, max_open_time):
+        self.failures = failures
+        self.open_time = open_time
+        self.max_open_time = max_open_time
+        self.state = HYSEN_CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self._backoff = open_time
+        self._open_until = None
+
+    # Returns HYSEN_CIRCUIT_CLOSED if the request can go, HYSEN_CIRCUIT_HALF_OPEN if it goes 
+    # as the probe, HYSEN_CIRCUIT_OPEN if it has to fail at once
+    def request(self, now):
+        if self.state == HYSEN_CIRCUIT_CLOSED:
+            return HYSEN_CIRCUIT_CLOSED
+        if (self.state == HYSEN_CIRCUIT_OPEN) and (now >= self._open_until):
+            self.state = HYSEN_CIRCUIT_HALF_OPEN
+            return HYSEN_CIRCUIT_HALF_OPEN
+        # open, or a probe is already in flight
+        return HYSEN_CIRCUIT_OPEN
+
+    def success(self):
+        if self.state != HYSEN_CIRCUIT_CLOSED:
+            _LOGGER.debug("Circuit closed.")
+        self.state = HYSEN_CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self._backoff = self.open_time
+
+    def failure(self, now):
+        if self.state == HYSEN_CIRCUIT_HALF_OPEN:
+            self._backoff = min(self._backoff * 2, self.max_open_time)
+            self._open(now)
+        elif self.state == HYSEN_CIRCUIT_CLOSED:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failures:
+                self._open(now)
+
+    # The probe didn't finish (e.g. it was cancelled), which tells nothing about the device
+    # The breaker opens again, the next request probes at once
+    def abort(self, now):
+        if self.state == HYSEN_CIRCUIT_HALF_OPEN:
+            self.state = HYSEN_CIRCUIT_OPEN
+            self._open_until = now
+
+    # Seconds left before the next probe, 0 if the breaker is closed
+    def retry_after(self, now):
+        if self.state != HYSEN_CIRCUIT_OPEN:
+            return 0
+        return max(self._open_until - now, 0)
+
+    def _open(self, now):
+        self.state = HYSEN_CIRCUIT_OPEN
+        # jittered, so the probes of a fleet gone down together don't all fire in the same tick
+        self._open_until = now + self._backoff * random.uniform(1.0, 1.25)
+        _LOGGER.debug("Circuit open for %.0f s.", self._open_until - now)
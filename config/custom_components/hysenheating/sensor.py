@@ -0,0 +1,158 @@
+"""
+Support for Hysen Thermostat Controller sensors.
+Hysen HY03-1-Wifi device
+http://www.xmhysen.com/products_detail/productId=197.html
+"""
+
+import logging
+
+from homeassistant.const import (
+    CONF_NAME,
+    CONF_HOST,
+    TEMP_CELSIUS,
+    DEVICE_CLASS_TEMPERATURE
+)
+
+from .climate import (
+    DATA_KEY,
+    HYSEN_SCHEDULE_TO_HASS,
+    ATTR_ROOM_TEMP,
+    ATTR_EXTERNAL_TEMP,
+    ATTR_EXTERNAL_TARGET_TEMP,
+    ATTR_HYSTERESIS,
+    ATTR_CALIBRATION,
+    ATTR_HEATING_MAX_TEMP,
+    ATTR_HEATING_MIN_TEMP,
+    ATTR_SCHEDULE,
+    ATTR_PERIOD1_HOUR,
+    ATTR_PERIOD1_MIN,
+    ATTR_PERIOD1_TEMP,
+    ATTR_PERIOD2_HOUR,
+    ATTR_PERIOD2_MIN,
+    ATTR_PERIOD2_TEMP,
+    ATTR_PERIOD3_HOUR,
+    ATTR_PERIOD3_MIN,
+    ATTR_PERIOD3_TEMP,
+    ATTR_PERIOD4_HOUR,
+    ATTR_PERIOD4_MIN,
+    ATTR_PERIOD4_TEMP,
+    ATTR_PERIOD5_HOUR,
+    ATTR_PERIOD5_MIN,
+    ATTR_PERIOD5_TEMP,
+    ATTR_PERIOD6_HOUR,
+    ATTR_PERIOD6_MIN,
+    ATTR_PERIOD6_TEMP,
+    ATTR_WE_PERIOD1_HOUR,
+    ATTR_WE_PERIOD1_MIN,
+    ATTR_WE_PERIOD1_TEMP,
+    ATTR_WE_PERIOD6_HOUR,
+    ATTR_WE_PERIOD6_MIN,
+    ATTR_WE_PERIOD6_TEMP
+)
+from .hysenheating_entity import HysenHeatingEntity
+
+_LOGGER = logging.getLogger(__name__)
+
+# (attribute, status field, unit, device class, conversion)
+SENSOR_TYPES = [
+    (ATTR_ROOM_TEMP,            'room_temp',           TEMP_CELSIUS, DEVICE_CLASS_TEMPERATURE, float),
+    (ATTR_EXTERNAL_TEMP,        'external_temp',       TEMP_CELSIUS, DEVICE_CLASS_TEMPERATURE, float),
+    (ATTR_EXTERNAL_TARGET_TEMP, 'external_limit_temp', TEMP_CELSIUS, DEVICE_CLASS_TEMPERATURE, float),
+    (ATTR_HYSTERESIS,           'hysteresis',          TEMP_CELSIUS, None,                     int),
+    (ATTR_CALIBRATION,          'calibration',         TEMP_CELSIUS, None,                     float),
+    (ATTR_HEATING_MAX_TEMP,     'max_temp',            TEMP_CELSIUS, DEVICE_CLASS_TEMPERATURE, int),
+    (ATTR_HEATING_MIN_TEMP,     'min_temp',            TEMP_CELSIUS, DEVICE_CLASS_TEMPERATURE, int),
+]
+
+# (attribute, status field, conversion)
+SCHEDULE_ATTRIBUTES = [
+    (ATTR_PERIOD1_HOUR,    'period1_hour',    int),
+    (ATTR_PERIOD1_MIN,     'period1_min',     int),
+    (ATTR_PERIOD1_TEMP,    'period1_temp',    float),
+    (ATTR_PERIOD2_HOUR,    'period2_hour',    int),
+    (ATTR_PERIOD2_MIN,     'period2_min',     int),
+    (ATTR_PERIOD2_TEMP,    'period2_temp',    float),
+    (ATTR_PERIOD3_HOUR,    'period3_hour',    int),
+    (ATTR_PERIOD3_MIN,     'period3_min',     int),
+    (ATTR_PERIOD3_TEMP,    'period3_temp',    float),
+    (ATTR_PERIOD4_HOUR,    'period4_hour',    int),
+    (ATTR_PERIOD4_MIN,     'period4_min',     int),
+    (ATTR_PERIOD4_TEMP,    'period4_temp',    float),
+    (ATTR_PERIOD5_HOUR,    'period5_hour',    int),
+    (ATTR_PERIOD5_MIN,     'period5_min',     int),
+    (ATTR_PERIOD5_TEMP,    'period5_temp',    float),
+    (ATTR_PERIOD6_HOUR,    'period6_hour',    int),
+    (ATTR_PERIOD6_MIN,     'period6_min',     int),
+    (ATTR_PERIOD6_TEMP,    'period6_temp',    float),
+    (ATTR_WE_PERIOD1_HOUR, 'we_period1_hour', int),
+    (ATTR_WE_PERIOD1_MIN,  'we_period1_min',  int),
+    (ATTR_WE_PERIOD1_TEMP, 'we_period1_temp', float),
+    (ATTR_WE_PERIOD6_HOUR, 'we_period6_hour', int),
+    (ATTR_WE_PERIOD6_MIN,  'we_period6_min',  int),
+    (ATTR_WE_PERIOD6_TEMP, 'we_period6_temp', float),
+]
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info = None):
+    """Set up the sensors of a Hysen heating thermostat."""
+    if discovery_info is None:
+        return
+
+    name = discovery_info[CONF_NAME]
+    heating = hass.data[DATA_KEY][discovery_info[CONF_HOST]]
+
+    sensors = [HysenHeatingSensor(name, heating, attribute, _field_value(field, convert), unit, device_class)
+               for attribute, field, unit, device_class, convert in SENSOR_TYPES]
+    sensors.append(HysenHeatingScheduleSensor(name, heating))
+
+    async_add_entities(sensors)
+
+def _field_value(field, convert):
+    """Return the getter of a converted status field."""
+    return lambda status: convert(getattr(status, field))
+
+def _schedule_value(status):
+    """Return the schedule mode and its periods."""
+    return (HYSEN_SCHEDULE_TO_HASS.get(status.schedule), 
+            {attribute: convert(getattr(status, field))
+             for attribute, field, convert in SCHEDULE_ATTRIBUTES})
+
+class HysenHeatingSensor(HysenHeatingEntity):
+    """Sensor fed from the status of a Hysen Heating thermostat."""
+
+    def __init__(self, name, heating, attribute, value, unit, device_class):
+        """Initialize the sensor."""
+        super().__init__('{} {}'.format(name, attribute.replace('_', ' ')), heating, value)
+        self._unit = unit
+        self._device_class = device_class
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        return self._value
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement."""
+        return self._unit
+
+    @property
+    def device_class(self):
+        """Return the device class of the sensor."""
+        return self._device_class
+
+class HysenHeatingScheduleSensor(HysenHeatingSensor):
+    """Weekly schedule of a Hysen Heating thermostat, the periods as attributes."""
+
+    def __init__(self, name, heating):
+        """Initialize the schedule sensor."""
+        super().__init__(name, heating, ATTR_SCHEDULE, _schedule_value, None, None)
+
+    @property
+    def state(self):
+        """Return the schedule mode."""
+        return None if self._value is None else self._value[0]
+
+    @property
+    def device_state_attributes(self):
+        """Return the schedule periods."""
+        return {} if self._value is None else self._value[1]